@@ -1,5 +1,53 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
 import bcrypt
 
+from core.storage import get_storage
+
+# bcrypt runs here rather than on the Streamlit script threads: at 12 rounds
+# each call is ~250 ms of CPU, so a burst of logins is capped at this many
+# cores instead of competing with every other session.
+_BCRYPT_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("QR_AUTH_WORKERS", 2)), thread_name_prefix="bcrypt"
+)
+
+# --- Session tokens ---
+# "<payload>.<signature>", both base64url: payload is JSON claims
+#   sub: who (e.g. "host:<checkpoint_id>"), exp: expiry (epoch seconds),
+#   fp: fingerprint of the password hash it was issued for, jti: token id,
+#   bnd: fingerprint of the display it was issued to (optional)
+# signed with HMAC-SHA256 under a key derived from QR_SECRET_KEY. Tokens ride
+# in the display URL, so they are short-lived and single-use: resuming
+# consumes one and the display is handed a fresh one. Changing the password
+# invalidates outstanding tokens; consumed and revoked ids are persisted in
+# storage (shared by all server processes) until they expire.
+DEFAULT_SESSION_TTL = 300
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _session_key() -> Optional[bytes]:
+    secret_key = os.getenv("QR_SECRET_KEY")
+    if not secret_key:
+        return None
+    # Separate key so session tokens can never be confused with QR signatures
+    return hmac.new(secret_key.encode("utf-8"), b"session-token", hashlib.sha256).digest()
+
+
 class AuthManager:
     @staticmethod
     def hash_password(password: str) -> str:
@@ -7,16 +55,108 @@ class AuthManager:
         Hash a password using bcrypt with automatic salt.
         Uses work factor of 12 (2^12 iterations) for security.
         """
-        salt = bcrypt.gensalt(rounds=12)
-        return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+        def run():
+            salt = bcrypt.gensalt(rounds=12)
+            return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+        return _BCRYPT_EXECUTOR.submit(run).result()
 
     @staticmethod
     def verify_password(password: str, password_hash: str) -> bool:
         """
         Verify a password against its bcrypt hash.
         """
+        def run():
+            try:
+                return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+            except (ValueError, TypeError):
+                # Handle invalid hash format gracefully
+                return False
+        return _BCRYPT_EXECUTOR.submit(run).result()
+
+    @staticmethod
+    def password_fingerprint(password_hash: str) -> str:
+        """Short digest of a stored password hash, binding session tokens to it."""
+        return hashlib.sha256(password_hash.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def binding_fingerprint(binding: Optional[str]) -> Optional[str]:
+        """Short digest of what a token is bound to (e.g. the display's User-Agent)."""
+        if binding is None:
+            return None
+        return hashlib.sha256(binding.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def session_ttl() -> int:
+        """Session token lifetime in seconds (QR_SESSION_TTL, default 5 minutes)."""
+        return int(os.getenv("QR_SESSION_TTL", DEFAULT_SESSION_TTL))
+
+    @staticmethod
+    def issue_session_token(subject: str, password_hash: str, ttl: Optional[int] = None,
+                            binding: Optional[str] = None) -> Optional[str]:
+        """
+        Signed single-use token letting `subject` resume without re-entering
+        the password within `ttl` seconds (default session_ttl()). With a
+        binding, only a caller presenting the same binding can use it. None if
+        no QR_SECRET_KEY is configured.
+        """
+        key = _session_key()
+        if key is None:
+            return None
+        ttl = ttl if ttl is not None else AuthManager.session_ttl()
+        claims = {
+            "sub": subject,
+            "exp": int(time.time()) + ttl,
+            "fp": AuthManager.password_fingerprint(password_hash),
+            "jti": secrets.token_hex(8),
+        }
+        if binding is not None:
+            claims["bnd"] = AuthManager.binding_fingerprint(binding)
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        signature = _b64encode(hmac.new(key, payload.encode("ascii"), hashlib.sha256).digest())
+        return f"{payload}.{signature}"
+
+    @staticmethod
+    def verify_session_token(token: str, binding: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Claims of a valid token (signature, expiry, binding and revocation
+        checked), or None. Does not consume it: see consume_session_token().
+        Callers still compare claims["fp"] against the current password hash
+        via password_fingerprint().
+        """
+        key = _session_key()
+        if key is None or not token:
+            return None
         try:
-            return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
-        except (ValueError, TypeError):
-            # Handle invalid hash format gracefully
-            return False
+            payload, signature = token.split(".")
+            expected = hmac.new(key, payload.encode("ascii"), hashlib.sha256).digest()
+            if not hmac.compare_digest(expected, _b64decode(signature)):
+                return None
+            claims = json.loads(_b64decode(payload))
+        except (ValueError, TypeError, UnicodeError):
+            return None
+        if not isinstance(claims, dict) or claims.get("exp", 0) < time.time():
+            return None
+        if "bnd" in claims and claims["bnd"] != AuthManager.binding_fingerprint(binding):
+            return None
+        if get_storage().is_token_id_revoked(claims.get("jti")):
+            return None
+        return claims
+
+    @staticmethod
+    def consume_session_token(token: str, binding: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Verify a token and mark it used, atomically across server processes:
+        of several requests presenting the same token only the first gets
+        its claims. The caller should issue the session a fresh token.
+        """
+        claims = AuthManager.verify_session_token(token, binding)
+        if claims is None or not get_storage().revoke_token_id(claims["jti"], claims["exp"]):
+            return None
+        return claims
+
+    @staticmethod
+    def revoke_session_token(token: str, binding: Optional[str] = None):
+        """Reject this token from now on (e.g. on Lock / Log Out, or when replaced)."""
+        claims = AuthManager.verify_session_token(token, binding)
+        if claims is not None:
+            get_storage().revoke_token_id(claims["jti"], claims["exp"])
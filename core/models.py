@@ -4,10 +4,18 @@ from typing import List, Dict, Any, Optional, Literal, Tuple
 import uuid
 import pytz
 
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")  # datetime.weekday() 순서
+
 @dataclass
 class AllowedHours:
     start_time: str  # "HH:MM" format (e.g., "09:00")
     end_time: str    # "HH:MM" format (e.g., "18:00")
+    # 요일별 시간대 (선택): 지정된 요일은 기본 시간 대신 이 목록을 사용, 빈 목록은 휴무
+    # e.g., {"sat": [{"start_time": "10:00", "end_time": "14:00"}], "sun": []}
+    weekly: Dict[str, List[Dict[str, str]]] = field(default_factory=dict)
+    # 날짜 예외 (선택): 기간 내에는 요일 설정 대신 windows 사용, 빈 목록은 휴무
+    # e.g., [{"start_date": "2026-12-25", "end_date": "2026-12-25", "windows": []}]
+    exceptions: List[Dict[str, Any]] = field(default_factory=list)
 
     def to_dict(self):
         return asdict(self)
@@ -122,6 +130,8 @@ class AdminSettings:
     admin_timezone: str = "Asia/Seoul"  # 관리자 타임존
     default_guest_timezone: str = "Asia/Seoul"  # 기본 방문객 타임존
     qr_refresh_interval: int = 1800     # QR 갱신 주기 (초)
+    dynamic_qr_mode: Literal["counter", "time_bucket"] = "counter"  # 동적 QR 순차번호 방식 (저장 카운터 / 시간 구간)
+    qr_payload_format: Literal["json", "compact"] = "json"  # QR 페이로드 형식 (JSON / 압축 Base45)
     require_time_sync: bool = True      # 시간 동기화 필수 여부
     created_at: str = field(default_factory=lambda: datetime.now(pytz.UTC).isoformat())
     updated_at: str = field(default_factory=lambda: datetime.now(pytz.UTC).isoformat())
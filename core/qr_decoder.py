@@ -0,0 +1,280 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+import ctypes.util
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageChops, ImageFilter, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Fix for macOS Homebrew zbar location
+original_find_library = ctypes.util.find_library
+
+def patched_find_library(name):
+    if name == 'zbar':
+        # Check standard Homebrew path
+        if os.path.exists('/opt/homebrew/lib/libzbar.dylib'):
+            return '/opt/homebrew/lib/libzbar.dylib'
+    return original_find_library(name)
+
+ctypes.util.find_library = patched_find_library
+
+# Try to import pyzbar
+try:
+    from pyzbar.pyzbar import decode, ZBarSymbol
+    PYZBAR_AVAILABLE = True
+except ImportError:
+    PYZBAR_AVAILABLE = False
+except Exception:
+    PYZBAR_AVAILABLE = False
+
+# Longest side (px) tried in order; None = the loaded image. Small sizes decode
+# fast and are enough for a QR filling a decent part of the frame.
+DECODE_SCALES = (800, 1280, None)
+# Large JPEGs are decoded at reduced size right away (JPEG draft mode)
+MAX_LOAD_SIZE = 2048
+# Adaptive threshold: pixels darker than their local mean by more than this become black
+THRESHOLD_OFFSET = 10
+
+
+@dataclass
+class DecodeResult:
+    data: Optional[str] = None   # Text of the first QR code found
+    stage: Optional[str] = None  # Pipeline step that decoded it, e.g. "contrast@800"
+    timings: List[Tuple[str, float]] = field(default_factory=list)  # (step, ms) in order
+
+    @property
+    def total_ms(self) -> float:
+        return sum(ms for _, ms in self.timings)
+
+
+def _autocontrast(image: Image.Image) -> Image.Image:
+    return ImageOps.autocontrast(image, cutoff=2)
+
+
+def _adaptive_threshold(image: Image.Image) -> Image.Image:
+    """Binarize against the local mean: survives glare and uneven lighting better than a global cut."""
+    radius = max(2, max(image.size) // 40)
+    local_mean = image.filter(ImageFilter.BoxBlur(radius))
+    darker_by = ImageChops.subtract(local_mean, image)
+    return darker_by.point(lambda v: 0 if v > THRESHOLD_OFFSET else 255)
+
+
+# Variants tried at each scale, cheapest first
+DECODE_VARIANTS: Tuple[Tuple[str, Optional[Callable[[Image.Image], Image.Image]]], ...] = (
+    ("plain", None),
+    ("contrast", _autocontrast),
+    ("threshold", _adaptive_threshold),
+)
+
+
+def _load_grayscale(source, result: DecodeResult) -> Image.Image:
+    start = time.perf_counter()
+    image = Image.open(source)
+    scale = MAX_LOAD_SIZE / max(image.size)
+    if scale < 1:
+        # JPEG only (no-op otherwise): decode straight to reduced size and grayscale
+        image.draft("L", (int(image.width * scale), int(image.height * scale)))
+    image.load()
+    result.timings.append(("load", (time.perf_counter() - start) * 1000))
+
+    start = time.perf_counter()
+    image = image.convert("L")
+    result.timings.append(("grayscale", (time.perf_counter() - start) * 1000))
+    return image
+
+
+def _downsample(image: Image.Image, longest_side: Optional[int]) -> Optional[Image.Image]:
+    """Image scaled to longest_side, or None if that would not make it smaller."""
+    if longest_side is None:
+        return image
+    if max(image.size) <= longest_side:
+        return None
+    image = image.copy()
+    image.thumbnail((longest_side, longest_side), Image.BILINEAR)
+    return image
+
+
+def decode_qr(source) -> DecodeResult:
+    """
+    Decode the first QR code in an image (path or file-like, e.g. a Streamlit
+    upload). Scales and variants are tried in order and the pipeline stops at
+    the first success; every step's duration is recorded in the result.
+    Raises RuntimeError if pyzbar is not available.
+    """
+    if not PYZBAR_AVAILABLE:
+        raise RuntimeError("pyzbar is not available")
+
+    result = DecodeResult()
+    image = _load_grayscale(source, result)
+
+    for longest_side in DECODE_SCALES:
+        start = time.perf_counter()
+        scaled = _downsample(image, longest_side)
+        if scaled is None:
+            continue
+        label = f"{max(scaled.size)}px"
+        result.timings.append((f"resize@{label}", (time.perf_counter() - start) * 1000))
+
+        for name, transform in DECODE_VARIANTS:
+            start = time.perf_counter()
+            candidate = transform(scaled) if transform else scaled
+            decoded = decode(candidate, symbols=[ZBarSymbol.QRCODE])
+            step = f"{name}@{label}"
+            result.timings.append((step, (time.perf_counter() - start) * 1000))
+            if decoded:
+                result.data = decoded[0].data.decode("utf-8")
+                result.stage = step
+                break
+        if result.data is not None:
+            break
+
+    logger.info(
+        "QR decode %s in %.1f ms: %s",
+        f"succeeded ({result.stage})" if result.data is not None else "failed",
+        result.total_ms,
+        ", ".join(f"{step}={ms:.1f}" for step, ms in result.timings)
+    )
+    return result
+
+
+def image_digest(data: bytes) -> str:
+    """Content hash identifying an uploaded image (decode cache / duplicate-scan key)."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class DecodeBusyError(RuntimeError):
+    """The decode service is at capacity; the caller should retry shortly."""
+
+
+class DecodeTimeoutError(TimeoutError):
+    """A decode did not finish within the request timeout."""
+
+
+class DecodeService:
+    """
+    Bounded decode pool shared by every session of the server. At most
+    `max_workers` decodes run at once and `max_queue` more may wait; beyond
+    that requests are rejected immediately (DecodeBusyError) instead of piling
+    up. Threads suffice: PIL and zbar release the GIL while they work.
+
+    A timed-out decode keeps its slot until it actually finishes, so a burst
+    of pathological images cannot oversubscribe the pool.
+
+    Results are cached by image digest (decoding is deterministic), so the
+    same upload submitted again - e.g. on a Streamlit rerun - skips the pool.
+    """
+    def __init__(self, max_workers: int = 2, max_queue: int = 8, timeout: float = 5.0,
+                 cache_size: int = 256):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="qr-decode")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._counts = {"completed": 0, "failed": 0, "rejected": 0, "timed_out": 0, "cache_hits": 0}
+        self._durations = deque(maxlen=200)  # (wait_ms, decode_ms) of recent decodes
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, DecodeResult]" = OrderedDict()
+
+    def decode(self, data: bytes, timeout: Optional[float] = None,
+               digest: Optional[str] = None) -> DecodeResult:
+        """
+        Decode image bytes on the pool (or from the cache; pass `digest` if
+        already computed). Raises DecodeBusyError when the queue is full and
+        DecodeTimeoutError when the result takes longer than `timeout`
+        seconds (default: the service timeout).
+        """
+        digest = digest or image_digest(data)
+        with self._lock:
+            cached = self._cache.get(digest)
+            if cached is not None:
+                self._cache.move_to_end(digest)
+                self._counts["cache_hits"] += 1
+                return cached
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._counts["rejected"] += 1
+            raise DecodeBusyError("Scanner is busy")
+        with self._lock:
+            self._queued += 1
+        future = self._executor.submit(self._run, data, digest, time.perf_counter())
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self._counts["timed_out"] += 1
+            raise DecodeTimeoutError("QR decode timed out")
+
+    def _run(self, data: bytes, digest: str, submitted_at: float) -> DecodeResult:
+        started_at = time.perf_counter()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        outcome = "failed"
+        try:
+            result = decode_qr(io.BytesIO(data))
+            outcome = "completed"
+            with self._lock:
+                self._cache[digest] = result
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            return result
+        finally:
+            finished_at = time.perf_counter()
+            with self._lock:
+                self._running -= 1
+                self._counts[outcome] += 1
+                self._durations.append(((started_at - submitted_at) * 1000, (finished_at - started_at) * 1000))
+            self._slots.release()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Snapshot of queue depth, outcome counters and recent wait/decode times (ms)."""
+        with self._lock:
+            durations = list(self._durations)
+            snapshot = {
+                "queue_depth": self._queued,
+                "running": self._running,
+                "capacity": self.max_workers + self.max_queue,
+                **self._counts,
+            }
+        decode_ms = sorted(d for _, d in durations)
+        snapshot["avg_wait_ms"] = sum(w for w, _ in durations) / len(durations) if durations else 0.0
+        snapshot["avg_decode_ms"] = sum(decode_ms) / len(decode_ms) if decode_ms else 0.0
+        snapshot["p95_decode_ms"] = decode_ms[int(len(decode_ms) * 0.95)] if decode_ms else 0.0
+        return snapshot
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_DECODE_SERVICE: Optional[DecodeService] = None
+_DECODE_SERVICE_LOCK = threading.Lock()
+
+
+def get_decode_service() -> DecodeService:
+    """
+    Return the process-wide decode service, sized from QR_DECODE_WORKERS
+    (default: CPU count, at most 4), QR_DECODE_QUEUE (default 4 per worker)
+    and QR_DECODE_TIMEOUT seconds (default 5).
+    """
+    global _DECODE_SERVICE
+    with _DECODE_SERVICE_LOCK:
+        if _DECODE_SERVICE is None:
+            workers = int(os.getenv("QR_DECODE_WORKERS", min(4, os.cpu_count() or 1)))
+            _DECODE_SERVICE = DecodeService(
+                max_workers=workers,
+                max_queue=int(os.getenv("QR_DECODE_QUEUE", workers * 4)),
+                timeout=float(os.getenv("QR_DECODE_TIMEOUT", 5.0)),
+            )
+        return _DECODE_SERVICE
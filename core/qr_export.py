@@ -0,0 +1,242 @@
+import io
+import os
+import re
+import zlib
+import zipfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from core.qr_manager import QRManager
+
+# Print layout: A4 at 150 dpi, in pixels and PDF points
+PAGE_SIZE_PX = (1240, 1754)
+PAGE_SIZE_PT = (595, 842)
+PAGE_MARGIN_PX = 60
+DEFAULT_GRID = (2, 3)  # columns, rows per page
+LABEL_SIZE_PX = (600, 760)  # single labelled QR (ZIP output)
+
+EXPORT_FORMATS = ("pdf", "zip")
+
+
+def _load_font(size: int, bold: bool = False, font_path: Optional[str] = None):
+    """TrueType font for labels: font_path, then DejaVu, then Pillow's built-in font."""
+    candidates = [font_path] if font_path else []
+    candidates.append("DejaVuSans-Bold.ttf" if bold else "DejaVuSans.ttf")
+    for candidate in candidates:
+        try:
+            return ImageFont.truetype(candidate, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:  # Pillow < 10.1
+        return ImageFont.load_default()
+
+
+def _fit_text(draw: ImageDraw.ImageDraw, text: str, font, max_width: int) -> str:
+    """Truncate text with an ellipsis so it fits max_width pixels."""
+    if draw.textlength(text, font=font) <= max_width:
+        return text
+    while text and draw.textlength(text + "…", font=font) > max_width:
+        text = text[:-1]
+    return text + "…"
+
+
+def render_label(checkpoint: Dict, size: Tuple[int, int], payload_format: str = "json",
+                 font_path: Optional[str] = None) -> bytes:
+    """
+    Render one static checkpoint QR with its name and location underneath,
+    sized to `size` pixels. Returns PNG bytes (small to pass between processes).
+    """
+    width, height = size
+    label = Image.new("L", size, 255)
+    draw = ImageDraw.Draw(label)
+
+    name_font = _load_font(max(12, height // 18), bold=True, font_path=font_path)
+    location_font = _load_font(max(10, height // 26), font_path=font_path)
+    text_height = height // 18 + height // 26 + height // 12
+
+    content = QRManager.generate_static_qr_content(checkpoint["id"], payload_format=payload_format)
+    qr_img = QRManager.generate_qr_image(content, box_size=1).convert("L")
+    # Integer scaling keeps modules crisp
+    scale = max(1, min(width, height - text_height) // qr_img.width)
+    qr_img = qr_img.resize((qr_img.width * scale, qr_img.height * scale), Image.NEAREST)
+    label.paste(qr_img, ((width - qr_img.width) // 2, 0))
+
+    y = qr_img.height
+    for text, font in ((checkpoint.get("name", ""), name_font), (checkpoint.get("location", ""), location_font)):
+        if text:
+            text = _fit_text(draw, text, font, width - 20)
+            draw.text((width // 2, y), text, fill=0, font=font, anchor="ma")
+            y += draw.textbbox((0, 0), "Ag", font=font)[3] + height // 48
+
+    buffer = io.BytesIO()
+    label.save(buffer, format="PNG", optimize=False)
+    return buffer.getvalue()
+
+
+def _render_task(args) -> bytes:
+    # Top-level so it can be pickled for the (CLI) process pool
+    return render_label(*args)
+
+
+def _render_parallel(tasks: List[tuple], max_workers: Optional[int], use_processes: bool = False) -> Iterator[bytes]:
+    """
+    Yield rendered labels in order. At most a few tasks per worker are in
+    flight, so finished images don't pile up in memory ahead of the writer.
+
+    Threads by default: Pillow's resize and zlib release the GIL for most of
+    the work, and a thread pool is safe to start from the Streamlit script
+    thread. use_processes=True renders on a spawn process pool for full
+    multi-core throughput; only use it from a program with a real
+    `if __name__ == "__main__"` guard (the CLI script). Under Streamlit,
+    __main__ is the page script, so spawned workers would re-run the page.
+    """
+    workers = max(1, min(max_workers or os.cpu_count() or 1, len(tasks)))
+    if use_processes:
+        # spawn: forking a threaded program is unsafe
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    else:
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="qr-export")
+    with pool:
+        window = workers * 4
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(_render_task, task))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class _PDFWriter:
+    """
+    Minimal PDF writer that streams one full-page grayscale image per page to
+    disk; only object offsets are kept in memory.
+    """
+    def __init__(self, path: str, page_size_pt: Tuple[int, int]):
+        self.file = open(path, "wb")
+        self.page_size_pt = page_size_pt
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = 3  # 1: catalog, 2: page tree (written at close)
+        self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write_object(self, obj_id: int, body: bytes, stream: Optional[bytes] = None):
+        self.offsets[obj_id] = self.file.tell()
+        self.file.write(f"{obj_id} 0 obj\n".encode() + body)
+        if stream is not None:
+            self.file.write(b"\nstream\n" + stream + b"\nendstream")
+        self.file.write(b"\nendobj\n")
+
+    def add_page(self, page: Image.Image):
+        page = page.convert("L")
+        image_id, content_id, page_id = self.next_id, self.next_id + 1, self.next_id + 2
+        self.next_id += 3
+        width_pt, height_pt = self.page_size_pt
+
+        data = zlib.compress(page.tobytes())
+        self._write_object(image_id, (
+            f"<< /Type /XObject /Subtype /Image /Width {page.width} /Height {page.height} "
+            f"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode /Length {len(data)} >>"
+        ).encode(), data)
+        content = f"q {width_pt} 0 0 {height_pt} 0 0 cm /Im0 Do Q".encode()
+        self._write_object(content_id, f"<< /Length {len(content)} >>".encode(), content)
+        self._write_object(page_id, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width_pt} {height_pt}] "
+            f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode())
+        self.page_ids.append(page_id)
+
+    def close(self):
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self._write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        self._write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>".encode())
+
+        xref_offset = self.file.tell()
+        self.file.write(f"xref\n0 {self.next_id}\n0000000000 65535 f \n".encode())
+        for obj_id in range(1, self.next_id):
+            self.file.write(f"{self.offsets[obj_id]:010d} 00000 n \n".encode())
+        self.file.write(
+            f"trailer\n<< /Size {self.next_id} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+        )
+        self.file.close()
+
+
+def _zip_entry_name(checkpoint: Dict, used: set) -> str:
+    base = re.sub(r'[\\/:*?"<>|\s]+', "_", checkpoint.get("name", "").strip()) or "checkpoint"
+    name = f"{base}.png"
+    if name in used:
+        name = f"{base}_{checkpoint['id'][:8]}.png"
+    used.add(name)
+    return name
+
+
+def export_qr_sheets(checkpoints: Iterable[Dict], output_path: str, export_format: str = "pdf",
+                     payload_format: str = "json", grid: Tuple[int, int] = DEFAULT_GRID,
+                     max_workers: Optional[int] = None, font_path: Optional[str] = None,
+                     progress: Optional[Callable[[int, int], None]] = None,
+                     use_processes: bool = False) -> int:
+    """
+    Render static QR labels for the given checkpoints in parallel and write
+    them to output_path: a multi-page PDF (grid of labels per A4 page) or a
+    ZIP of one PNG per checkpoint. Pages/entries are written as labels
+    arrive. Returns the number of labels written. use_processes: see
+    _render_parallel (CLI only).
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format!r}")
+    checkpoints = list(checkpoints)
+    total = len(checkpoints)
+    if not checkpoints:
+        raise ValueError("No checkpoints to export")
+
+    if export_format == "pdf":
+        columns, rows = grid
+        cell_w = (PAGE_SIZE_PX[0] - 2 * PAGE_MARGIN_PX) // columns
+        cell_h = (PAGE_SIZE_PX[1] - 2 * PAGE_MARGIN_PX) // rows
+        label_size = (cell_w - 20, cell_h - 20)
+    else:
+        label_size = LABEL_SIZE_PX
+
+    font_path = font_path or os.getenv("QR_LABEL_FONT")
+    tasks = [(cp, label_size, payload_format, font_path) for cp in checkpoints]
+    labels = _render_parallel(tasks, max_workers, use_processes)
+    written = 0
+
+    if export_format == "pdf":
+        writer = _PDFWriter(output_path, PAGE_SIZE_PT)
+        try:
+            per_page = columns * rows
+            page = None
+            for index, png in enumerate(labels):
+                slot = index % per_page
+                if slot == 0:
+                    if page is not None:
+                        writer.add_page(page)
+                    page = Image.new("L", PAGE_SIZE_PX, 255)
+                x = PAGE_MARGIN_PX + (slot % columns) * cell_w + 10
+                y = PAGE_MARGIN_PX + (slot // columns) * cell_h + 10
+                page.paste(Image.open(io.BytesIO(png)), (x, y))
+                written += 1
+                if progress:
+                    progress(written, total)
+            if page is not None:
+                writer.add_page(page)
+        finally:
+            writer.close()
+    else:
+        used_names = set()
+        with zipfile.ZipFile(output_path, "w", compression=zipfile.ZIP_STORED) as archive:
+            # PNG is already compressed, so entries are stored as-is
+            for index, png in enumerate(labels):
+                archive.writestr(_zip_entry_name(checkpoints[index], used_names), png)
+                written += 1
+                if progress:
+                    progress(written, total)
+
+    return written
@@ -3,38 +3,154 @@ import json
 import hmac
 import hashlib
 import os
-from datetime import datetime, timedelta
+import struct
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from typing import Optional, Dict, Tuple, Any
 from PIL import Image
 import io
 import base64
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Rendered images kept by generate_qr_bytes (a Host display only ever needs the
+# current code, so this comfortably covers many displays per server).
+QR_IMAGE_CACHE_SIZE = 128
+
+# Background renderer warming the image caches ahead of time (see prerender_qr_svg)
+_PRERENDER_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="qr-prerender")
+
+# --- Compact payload ("2.0") ---
+# Packed binary fields, Base45-encoded (RFC 9285) so the whole string fits the
+# QR alphanumeric mode. Layout (big-endian):
+#   version(B) mode(B) checkpoint_uuid(16s)                 -- static
+#   ... sequence(I) issued_at_epoch(I) refresh_interval(I)  -- dynamic
+#   ... hmac_sha256[:COMPACT_SIGNATURE_BYTES]
+# expires_at is issued_at + refresh_interval, so it is covered by the signature.
+COMPACT_PREFIX = "QIO:"
+COMPACT_VERSION = 2
+COMPACT_SIGNATURE_BYTES = 16
+_COMPACT_HEADER = struct.Struct(">BB16s")
+_COMPACT_DYNAMIC = struct.Struct(">III")
+_COMPACT_MODES = {"static": 0, "dynamic": 1}
+
+# Signing keys, loaded once per process (see QRManager.reload_secret_keys):
+# {"current": key_id, "keys": {key_id: keyed HMAC-SHA256 object}}. Signing
+# copies the prepared object instead of re-reading the environment and
+# re-deriving the HMAC pads on every call.
+_KEY_CONTEXT: Optional[Dict[str, Any]] = None
+_KEY_CONTEXT_LOCK = threading.Lock()
+
+_BASE45_CHARSET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:"
+_BASE45_VALUES = {c: i for i, c in enumerate(_BASE45_CHARSET)}
+
+
+def _base45_encode(data: bytes) -> str:
+    chars = []
+    for i in range(0, len(data) - 1, 2):
+        n = data[i] * 256 + data[i + 1]
+        n, c = divmod(n, 45)
+        e, d = divmod(n, 45)
+        chars += (_BASE45_CHARSET[c], _BASE45_CHARSET[d], _BASE45_CHARSET[e])
+    if len(data) % 2:
+        d, c = divmod(data[-1], 45)
+        chars += (_BASE45_CHARSET[c], _BASE45_CHARSET[d])
+    return "".join(chars)
+
+
+def _base45_decode(text: str) -> bytes:
+    """Raises ValueError on characters or groups that are not valid Base45."""
+    if len(text) % 3 == 1:
+        raise ValueError("Invalid Base45 length")
+    values = [_BASE45_VALUES[c] for c in text]  # KeyError for foreign characters
+    out = bytearray()
+    for i in range(0, len(values), 3):
+        group = values[i:i + 3]
+        n = sum(v * 45 ** k for k, v in enumerate(group))
+        if len(group) == 3:
+            if n > 0xFFFF:
+                raise ValueError("Invalid Base45 group")
+            out += n.to_bytes(2, "big")
+        else:
+            if n > 0xFF:
+                raise ValueError("Invalid Base45 group")
+            out.append(n)
+    return bytes(out)
+
 
 class QRManager:
     @staticmethod
-    def _get_secret_key() -> str:
+    def _get_secret_key(env_name: str = "QR_SECRET_KEY") -> str:
         """
         Get SECRET_KEY from environment variable.
         Raises ValueError if not set or too short.
         """
-        secret_key = os.getenv("QR_SECRET_KEY")
+        secret_key = os.getenv(env_name)
 
         if not secret_key:
             raise ValueError(
-                "QR_SECRET_KEY environment variable not set! "
+                f"{env_name} environment variable not set! "
                 "Please set it in .env file or environment. "
                 "Generate a secure key with: python -c \"import secrets; print(secrets.token_hex(32))\""
             )
 
         if len(secret_key) < 32:
             raise ValueError(
-                f"QR_SECRET_KEY must be at least 32 characters (current: {len(secret_key)}). "
+                f"{env_name} must be at least 32 characters (current: {len(secret_key)}). "
                 "Generate a secure key with: python -c \"import secrets; print(secrets.token_hex(32))\""
             )
 
         return secret_key
 
     @staticmethod
-    def generate_static_qr_content(checkpoint_id: str) -> str:
+    def get_key_id(secret_key: str) -> str:
+        """Short public identifier of a key, embedded in payloads to select the verifying key."""
+        return hashlib.sha256(secret_key.encode()).hexdigest()[:8]
+
+    @staticmethod
+    def reload_secret_keys(secret_key: Optional[str] = None, previous_key: Optional[str] = None) -> str:
+        """
+        (Re)load the signing keys. Without arguments they are read from
+        QR_SECRET_KEY and the optional QR_SECRET_KEY_PREVIOUS; pass them
+        explicitly to rotate at runtime. Codes signed with the previous key
+        keep verifying until it is dropped. Returns the current key id.
+        """
+        global _KEY_CONTEXT
+        if secret_key is None:
+            secret_key = QRManager._get_secret_key()
+            if os.getenv("QR_SECRET_KEY_PREVIOUS"):
+                previous_key = QRManager._get_secret_key("QR_SECRET_KEY_PREVIOUS")
+
+        keys = {}
+        for key in (previous_key, secret_key):
+            if key:
+                keys[QRManager.get_key_id(key)] = hmac.new(key.encode(), digestmod=hashlib.sha256)
+        current = QRManager.get_key_id(secret_key)
+        with _KEY_CONTEXT_LOCK:
+            _KEY_CONTEXT = {"current": current, "keys": keys}
+        return current
+
+    @staticmethod
+    def _get_key_context() -> Dict[str, Any]:
+        if _KEY_CONTEXT is None:
+            QRManager.reload_secret_keys()
+        return _KEY_CONTEXT
+
+    @staticmethod
+    def _hmac_digest(data: bytes, key_id: Optional[str] = None) -> bytes:
+        """HMAC-SHA256 of data with the given key (default: current). Raises KeyError for unknown key ids."""
+        context = QRManager._get_key_context()
+        mac = context["keys"][key_id or context["current"]].copy()
+        mac.update(data)
+        return mac.digest()
+
+    @staticmethod
+    def generate_static_qr_content(checkpoint_id: str, payload_format: str = "json") -> str:
+        if payload_format == "compact":
+            return QRManager._encode_compact(_COMPACT_HEADER.pack(
+                COMPACT_VERSION, _COMPACT_MODES["static"], uuid.UUID(checkpoint_id).bytes
+            ))
         content = {
             "type": "qr_in_out",
             "version": "1.0",
@@ -47,7 +163,13 @@ class QRManager:
     @staticmethod
     def generate_dynamic_qr_content(checkpoint_id: str, current_sequence: int, 
                                      issued_at: datetime, expires_at: datetime,
-                                     refresh_interval: int = 1800) -> str:
+                                     refresh_interval: int = 1800,
+                                     payload_format: str = "json") -> str:
+        if payload_format == "compact":
+            packed = QRManager._pack_compact_dynamic(
+                checkpoint_id, current_sequence, int(issued_at.timestamp()), refresh_interval
+            )
+            return QRManager._encode_compact(packed + QRManager._compact_signature(packed))
         content = {
             "type": "qr_in_out",
             "version": "1.0",
@@ -56,7 +178,8 @@ class QRManager:
             "sequence": current_sequence,
             "issued_at": issued_at.isoformat(),
             "expires_at": expires_at.isoformat(),
-            "refresh_interval": refresh_interval
+            "refresh_interval": refresh_interval,
+            "key_id": QRManager._get_key_context()["current"]
         }
         
         # Add signature
@@ -65,16 +188,105 @@ class QRManager:
         
         return json.dumps(content)
 
+    # --- Time-bucket (TOTP-style) sequences ---
+    # sequence = floor(epoch / refresh_interval): every host and the guest
+    # validator derive the same sequence from the clock, with no stored counter.
+
+    @staticmethod
+    def get_time_bucket(current_time: datetime, refresh_interval: int) -> Tuple[int, datetime, datetime]:
+        """Return (sequence, issued_at, expires_at) of the bucket containing current_time (UTC datetimes)."""
+        sequence = int(current_time.timestamp()) // refresh_interval
+        issued_at = datetime.fromtimestamp(sequence * refresh_interval, tz=timezone.utc)
+        return sequence, issued_at, issued_at + timedelta(seconds=refresh_interval)
+
+    @staticmethod
+    def generate_time_bucket_qr_content(checkpoint_id: str, current_time: datetime,
+                                        refresh_interval: int = 1800,
+                                        payload_format: str = "json") -> str:
+        sequence, issued_at, expires_at = QRManager.get_time_bucket(current_time, refresh_interval)
+        return QRManager.generate_dynamic_qr_content(
+            checkpoint_id, sequence, issued_at, expires_at, refresh_interval, payload_format
+        )
+
     @staticmethod
-    def _generate_signature(content: Dict[str, Any]) -> str:
+    def validate_time_bucket_sequence(qr_content: Dict, current_time: datetime,
+                                      refresh_interval: int) -> Tuple[bool, str]:
+        """
+        Check a (signature-verified) time-bucket QR against the current bucket.
+        The signed issued_at must match the signed sequence's bucket start.
+        """
+        try:
+            sequence = int(qr_content.get("sequence"))
+            issued_at = datetime.fromisoformat(qr_content.get("issued_at"))
+        except (TypeError, ValueError):
+            return False, "Invalid sequence"
+        if int(issued_at.timestamp()) != sequence * refresh_interval:
+            return False, "Invalid sequence"
+
+        current_sequence, _, _ = QRManager.get_time_bucket(current_time, refresh_interval)
+        if sequence < current_sequence:
+            return False, "Expired QR Code (Old sequence). Please scan a fresh code."
+        if sequence > current_sequence:
+            return False, "QR code is not valid yet. Please check the time settings."
+        return True, "Valid"
+
+    @staticmethod
+    def _generate_signature(content: Dict[str, Any], key_id: Optional[str] = None) -> str:
         # Create a canonical string representation excluding the signature itself
         data_to_sign = f"{content['checkpoint_id']}|{content['sequence']}|{content['issued_at']}"
-        secret_key = QRManager._get_secret_key()
-        return hmac.new(
-            secret_key.encode(),
-            data_to_sign.encode(),
-            hashlib.sha256
-        ).hexdigest()
+        return QRManager._hmac_digest(data_to_sign.encode(), key_id).hex()
+
+    # --- Compact payload helpers ---
+
+    @staticmethod
+    def _encode_compact(data: bytes) -> str:
+        return COMPACT_PREFIX + _base45_encode(data)
+
+    @staticmethod
+    def _pack_compact_dynamic(checkpoint_id: str, sequence: int, issued_at_epoch: int,
+                              refresh_interval: int) -> bytes:
+        return _COMPACT_HEADER.pack(
+            COMPACT_VERSION, _COMPACT_MODES["dynamic"], uuid.UUID(checkpoint_id).bytes
+        ) + _COMPACT_DYNAMIC.pack(sequence, issued_at_epoch, refresh_interval)
+
+    @staticmethod
+    def _compact_signature(packed: bytes, key_id: Optional[str] = None) -> bytes:
+        return QRManager._hmac_digest(packed, key_id)[:COMPACT_SIGNATURE_BYTES]
+
+    @staticmethod
+    def _parse_compact(qr_string: str) -> Optional[Dict]:
+        """Decode a compact payload into the same dict shape as the JSON format."""
+        try:
+            data = _base45_decode(qr_string[len(COMPACT_PREFIX):])
+            version, mode_flag, cp_bytes = _COMPACT_HEADER.unpack_from(data)
+        except (KeyError, ValueError, struct.error):
+            return None
+        if version != COMPACT_VERSION:
+            return None
+
+        content = {
+            "type": "qr_in_out",
+            "version": f"{COMPACT_VERSION}.0",
+            "checkpoint_id": str(uuid.UUID(bytes=cp_bytes)),
+        }
+        if mode_flag == _COMPACT_MODES["static"] and len(data) == _COMPACT_HEADER.size:
+            content["qr_mode"] = "static"
+            return content
+
+        body_end = _COMPACT_HEADER.size + _COMPACT_DYNAMIC.size
+        if mode_flag != _COMPACT_MODES["dynamic"] or len(data) != body_end + COMPACT_SIGNATURE_BYTES:
+            return None
+        sequence, issued_epoch, refresh_interval = _COMPACT_DYNAMIC.unpack_from(data, _COMPACT_HEADER.size)
+        issued_at = datetime.fromtimestamp(issued_epoch, tz=timezone.utc)
+        content.update({
+            "qr_mode": "dynamic",
+            "sequence": sequence,
+            "issued_at": issued_at.isoformat(),
+            "expires_at": (issued_at + timedelta(seconds=refresh_interval)).isoformat(),
+            "refresh_interval": refresh_interval,
+            "signature": data[body_end:].hex(),
+        })
+        return content
 
     @staticmethod
     def generate_qr_image(content: str, box_size: int = 10) -> Image:
@@ -88,8 +300,72 @@ class QRManager:
         qr.make(fit=True)
         return qr.make_image(fill_color="black", back_color="white")
 
+    @staticmethod
+    @lru_cache(maxsize=QR_IMAGE_CACHE_SIZE)
+    def generate_qr_bytes(content: str, box_size: int = 10, image_format: str = "PNG") -> bytes:
+        """
+        Render content to encoded image bytes.
+        LRU-cached by (content, box_size, image_format): the Host page reruns
+        every second but the payload only changes once per refresh interval.
+        """
+        qr_img = QRManager.generate_qr_image(content, box_size=box_size)
+        img_bytes = io.BytesIO()
+        qr_img.save(img_bytes, format=image_format)
+        return img_bytes.getvalue()
+
+    @staticmethod
+    @lru_cache(maxsize=QR_IMAGE_CACHE_SIZE)
+    def generate_qr_matrix(content: str, border: int = 4) -> Tuple[Tuple[bool, ...], ...]:
+        """Module matrix (True = dark), including the quiet-zone border. Cached, hence immutable."""
+        qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L, border=border)
+        qr.add_data(content)
+        qr.make(fit=True)
+        return tuple(tuple(row) for row in qr.get_matrix())
+
+    @staticmethod
+    @lru_cache(maxsize=QR_IMAGE_CACHE_SIZE)
+    def generate_qr_svg(content: str, border: int = 4) -> str:
+        """
+        Render content as a scalable SVG: one stroked path, one segment per
+        horizontal run of dark modules (relative moves keep it to a few KB).
+        No rasterization or compression, and the browser scales it to any
+        display size.
+        """
+        matrix = QRManager.generate_qr_matrix(content, border)
+        size = len(matrix)
+        segments = []
+        for y, row in enumerate(matrix):
+            pen = None  # x where the previous run on this row ended
+            x = 0
+            while x < size:
+                if row[x]:
+                    start = x
+                    while x < size and row[x]:
+                        x += 1
+                    move = f"M{start} {y}.5" if pen is None else f"m{start - pen} 0"
+                    segments.append(f"{move}h{x - start}")
+                    pen = x
+                else:
+                    x += 1
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" '
+            f'shape-rendering="crispEdges"><rect width="{size}" height="{size}" fill="#fff"/>'
+            f'<path stroke="#000" d="{"".join(segments)}"/></svg>'
+        )
+
+    @staticmethod
+    def prerender_qr_svg(content: str) -> Future:
+        """
+        Render content into the generate_qr_svg cache on a background thread,
+        so a later generate_qr_svg(content) (e.g. at rotation) is a cache hit.
+        """
+        return _PRERENDER_EXECUTOR.submit(QRManager.generate_qr_svg, content)
+
     @staticmethod
     def parse_qr_content(qr_string: str) -> Optional[Dict]:
+        """Parse either payload format ("1.0" JSON or compact "2.0")."""
+        if qr_string.startswith(COMPACT_PREFIX):
+            return QRManager._parse_compact(qr_string)
         try:
             return json.loads(qr_string)
         except Exception:
@@ -100,8 +376,27 @@ class QRManager:
         if "signature" not in qr_content:
             return False
         
-        expected_sig = QRManager._generate_signature(qr_content)
-        return hmac.compare_digest(qr_content["signature"], expected_sig)
+        # Codes carrying a key id are checked against that key only; older
+        # codes (and compact ones, which have no room for it) try each loaded key.
+        key_ids = list(QRManager._get_key_context()["keys"])
+        if qr_content.get("key_id") is not None:
+            if qr_content["key_id"] not in key_ids:
+                return False
+            key_ids = [qr_content["key_id"]]
+
+        if qr_content.get("version") == f"{COMPACT_VERSION}.0":
+            try:
+                packed = QRManager._pack_compact_dynamic(
+                    qr_content["checkpoint_id"], qr_content["sequence"],
+                    int(datetime.fromisoformat(qr_content["issued_at"]).timestamp()),
+                    qr_content["refresh_interval"]
+                )
+            except (KeyError, TypeError, ValueError, struct.error):
+                return False
+            sign = lambda key_id: QRManager._compact_signature(packed, key_id).hex()
+        else:
+            sign = lambda key_id: QRManager._generate_signature(qr_content, key_id)
+        return any(hmac.compare_digest(qr_content["signature"], sign(key_id)) for key_id in key_ids)
 
     @staticmethod
     def is_qr_expired(qr_content: Dict, current_time: datetime) -> bool:
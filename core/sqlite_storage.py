@@ -0,0 +1,348 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime, date, timedelta
+import pytz
+
+from core.storage import BaseStorage
+
+# Connections shared per database file. Streamlit re-creates the storage object
+# on every rerun, so opening (and re-initialising) a connection each time would
+# defeat the point. sqlite3 objects are serialised through the paired lock.
+_CONNECTIONS: Dict[str, Tuple[sqlite3.Connection, threading.RLock]] = {}
+_CONNECTIONS_LOCK = threading.Lock()
+# Databases whose presence table has been checked this process
+_PRESENCE_CHECKED = set()
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Drop-in replacement for JSONStorage backed by a single SQLite database
+    (WAL mode). Each entity type is a table holding the full record as JSON in
+    `data`, plus copies of the fields we filter on as indexed columns.
+    """
+    # entity_type -> columns extracted from the record and indexed
+    INDEXED_COLUMNS = {
+        "checkpoints": ("name", "deleted_at"),
+        "guests": ("email", "deleted_at"),
+        "activity_logs": ("timestamp", "guest_id", "checkpoint_id", "status"),
+        "admin_settings": (),
+        "admin_credentials": (),
+        "presence": ("guest_id", "checkpoint_id"),
+        "revoked_tokens": ("exp",),
+    }
+    # entity_type -> expression indexes backing the secondary index lookups
+    EXPRESSION_INDEXES = {
+        "guests": {"email_normalized": "lower(trim(email))"},
+    }
+    # (entity_type, index_name) -> (SQL prefilter, function mapping the lookup key to its parameter)
+    # Candidates are re-checked with the Python key function, which is the source of truth.
+    SECONDARY_PREFILTERS = {
+        ("guests", "email"): ("lower(trim(email)) = ?", lambda key: key),
+        ("guests", "name_email"): ("lower(trim(email)) = ?", lambda key: key[1]),
+        ("checkpoints", "name"): ("name = ?", lambda key: key),
+    }
+
+    def __init__(self, db_path: str = os.path.join("data", "qr_in_out.db")):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self.conn, self.lock = self._get_connection(db_path)
+        self._known_tables = set()
+
+    @staticmethod
+    def _get_connection(db_path: str) -> Tuple[sqlite3.Connection, threading.RLock]:
+        key = os.path.abspath(db_path)
+        with _CONNECTIONS_LOCK:
+            if key not in _CONNECTIONS:
+                conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("PRAGMA busy_timeout=5000")
+                _CONNECTIONS[key] = (conn, threading.RLock())
+            return _CONNECTIONS[key]
+
+    def _columns(self, entity_type: str) -> Tuple[str, ...]:
+        return self.INDEXED_COLUMNS.get(entity_type, ())
+
+    def _table(self, entity_type: str) -> str:
+        """Return the table name for entity_type, creating table and indexes on first use."""
+        if not _IDENTIFIER.match(entity_type):
+            raise ValueError(f"Invalid entity type: {entity_type!r}")
+        if entity_type not in self._known_tables:
+            columns = "".join(f", {c} TEXT" for c in self._columns(entity_type))
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {entity_type} "
+                f"(seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT{columns}, data TEXT NOT NULL)"
+            )
+            self.conn.execute(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{entity_type}_id ON {entity_type}(id)"
+            )
+            for column in self._columns(entity_type):
+                self.conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_{entity_type}_{column} ON {entity_type}({column})"
+                )
+            for name, expression in self.EXPRESSION_INDEXES.get(entity_type, {}).items():
+                self.conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_{entity_type}_{name} ON {entity_type}({expression})"
+                )
+            self._known_tables.add(entity_type)
+        return entity_type
+
+    def _row_values(self, entity_type: str, entity: Dict[str, Any]) -> Tuple:
+        values = [entity.get('id')]
+        values += [entity.get(c) for c in self._columns(entity_type)]
+        values.append(json.dumps(entity, ensure_ascii=False))
+        return tuple(values)
+
+    def _insert_sql(self, entity_type: str) -> str:
+        table = self._table(entity_type)
+        columns = ("id",) + self._columns(entity_type) + ("data",)
+        placeholders = ", ".join("?" for _ in columns)
+        return f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+
+    def _select(self, entity_type: str, where: str = "", params: Tuple = ()) -> List[Dict[str, Any]]:
+        table = self._table(entity_type)
+        sql = f"SELECT data FROM {table}"
+        if where:
+            sql += f" WHERE {where}"
+        sql += " ORDER BY seq"
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    # --- CRUD ---
+
+    def load(self, entity_type: str) -> List[Dict[str, Any]]:
+        return self._select(entity_type)
+
+    def save(self, entity_type: str, data: List[Dict[str, Any]]):
+        table = self._table(entity_type)
+        sql = self._insert_sql(entity_type)
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(f"DELETE FROM {table}")
+                self.conn.executemany(sql, [self._row_values(entity_type, item) for item in data])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        self._on_logs_rewritten(entity_type)
+
+    def add(self, entity_type: str, entity: Dict[str, Any]):
+        self.add_many(entity_type, [entity])
+
+    def add_many(self, entity_type: str, entities: List[Dict[str, Any]]):
+        """Add several records in a single transaction."""
+        if not entities:
+            return
+        sql = self._insert_sql(entity_type)
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(sql, [self._row_values(entity_type, item) for item in entities])
+                if entity_type == "activity_logs":
+                    # Same transaction: presence can never disagree with the logs
+                    self._update_presence(entities)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def update(self, entity_type: str, entity_id: str, updates: Dict[str, Any]):
+        table = self._table(entity_type)
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(f"SELECT data FROM {table} WHERE id = ?", (entity_id,)).fetchone()
+                if row is not None:
+                    old = json.loads(row[0])
+                    item = dict(old, **updates)
+                    self._rewrite_row(entity_type, entity_id, item)
+                    self._on_log_changed(entity_type, [old, item])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _rewrite_row(self, entity_type: str, entity_id: str, item: Dict[str, Any]):
+        """Store an updated record in place. Must run inside the caller's transaction."""
+        item['updated_at'] = datetime.now(pytz.UTC).isoformat()
+        columns = self._columns(entity_type) + ("data",)
+        assignments = ", ".join(f"{c} = ?" for c in columns)
+        self.conn.execute(
+            f"UPDATE {self._table(entity_type)} SET {assignments} WHERE id = ?",
+            self._row_values(entity_type, item)[1:] + (entity_id,)
+        )
+
+    def revoke_token_id(self, jti: str, exp: float) -> bool:
+        table = self._table(self.REVOKED_TOKENS_ENTITY)
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(f"DELETE FROM {table} WHERE CAST(exp AS REAL) < ?", (time.time(),))
+                # The unique id index makes this the atomic "first use wins" check
+                cursor = self.conn.execute(
+                    f"INSERT OR IGNORE INTO {table} (id, exp, data) VALUES (?, ?, ?)",
+                    (jti, exp, json.dumps({"id": jti, "exp": exp}))
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return cursor.rowcount == 1
+
+    def advance_qr_sequence(self, checkpoint_id: str, sequence: int) -> int:
+        table = self._table("checkpoints")
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(f"SELECT data FROM {table} WHERE id = ?", (checkpoint_id,)).fetchone()
+                stored = sequence
+                if row is not None:
+                    item = json.loads(row[0])
+                    stored = item.get("current_qr_sequence", 0)
+                    if sequence > stored:
+                        item["current_qr_sequence"] = stored = sequence
+                        self._rewrite_row("checkpoints", checkpoint_id, item)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return stored
+
+    def delete(self, entity_type: str, entity_id: str):
+        # Physical delete - use with caution
+        table = self._table(entity_type)
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(f"SELECT data FROM {table} WHERE id = ?", (entity_id,)).fetchone()
+                if row is not None:
+                    self.conn.execute(f"DELETE FROM {table} WHERE id = ?", (entity_id,))
+                    self._on_log_changed(entity_type, [json.loads(row[0])])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def get_by_id(self, entity_type: str, entity_id: str) -> Optional[Dict]:
+        data = self._select(entity_type, "id = ?", (entity_id,))
+        return data[0] if data else None
+
+    # Bound parameters per IN (...) query, below SQLite's variable limit
+    ID_LOOKUP_CHUNK = 500
+
+    def find_unstored(self, entity_type: str, entities: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        table = self._table(entity_type)
+        ids = [entity.get('id') for entity in entities]
+        stored = set()
+        with self.lock:
+            for i in range(0, len(ids), self.ID_LOOKUP_CHUNK):
+                chunk = ids[i:i + self.ID_LOOKUP_CHUNK]
+                placeholders = ", ".join("?" for _ in chunk)
+                rows = self.conn.execute(f"SELECT id FROM {table} WHERE id IN ({placeholders})", chunk)
+                stored.update(row[0] for row in rows)
+        return [entity for entity in entities if entity.get('id') not in stored]
+
+    def get_active_checkpoints(self) -> List[Dict]:
+        return self._select("checkpoints", "deleted_at IS NULL")
+
+    def get_active_guests(self) -> List[Dict]:
+        return self._select("guests", "deleted_at IS NULL")
+
+    def _find_ids(self, entity_type: str, index_name: str, key: Any) -> List[str]:
+        where, to_param = self.SECONDARY_PREFILTERS[(entity_type, index_name)]
+        key_func = self.SECONDARY_INDEXES[entity_type][index_name]
+        candidates = self._select(entity_type, f"{where} AND deleted_at IS NULL", (to_param(key),))
+        return [item["id"] for item in candidates if key_func(item) == key]
+
+    # --- Presence ---
+
+    def _update_presence(self, logs: List[Dict[str, Any]]):
+        """Fold new logs into the presence table. Must run inside the caller's transaction."""
+        table = self._table(self.PRESENCE_ENTITY)
+        presence = {}
+        for log in logs:
+            presence_id = self._presence_id(log.get("guest_id"), log.get("checkpoint_id"))
+            if log.get("status") != "success" or presence_id in presence:
+                continue
+            row = self.conn.execute(f"SELECT data FROM {table} WHERE id = ?", (presence_id,)).fetchone()
+            if row is not None:
+                presence[presence_id] = json.loads(row[0])
+        before = {k: v.get("log_id") for k, v in presence.items()}
+        if self._apply_presence(presence, logs):
+            changed = [v for k, v in presence.items() if before.get(k) != v.get("log_id")]
+            self.conn.executemany(self._insert_sql(self.PRESENCE_ENTITY),
+                                  [self._row_values(self.PRESENCE_ENTITY, item) for item in changed])
+
+    def _on_logs_rewritten(self, entity_type: str):
+        # Rewrites (rather than inserts) may drop or alter logs: recompute from scratch
+        if entity_type == "activity_logs":
+            self.rebuild_presence()
+
+    def _on_log_changed(self, entity_type: str, versions: List[Dict[str, Any]]):
+        """
+        A single log was edited or deleted (versions: its old and new
+        records): recompute presence for the pairs involved only, from their
+        latest successful log. Must run inside the caller's transaction.
+        """
+        if entity_type != "activity_logs":
+            return
+        logs_table = self._table(entity_type)
+        presence_table = self._table(self.PRESENCE_ENTITY)
+        pairs = {(v.get("guest_id"), v.get("checkpoint_id")) for v in versions}
+        for guest_id, checkpoint_id in pairs:
+            presence_id = self._presence_id(guest_id, checkpoint_id)
+            row = self.conn.execute(
+                f"SELECT data FROM {logs_table} WHERE guest_id = ? AND checkpoint_id = ? AND status = 'success' "
+                "ORDER BY timestamp DESC, seq DESC LIMIT 1",
+                (guest_id, checkpoint_id)
+            ).fetchone()
+            self.conn.execute(f"DELETE FROM {presence_table} WHERE id = ?", (presence_id,))
+            if row is not None:
+                presence = {}
+                self._apply_presence(presence, [json.loads(row[0])])
+                self.conn.execute(self._insert_sql(self.PRESENCE_ENTITY),
+                                  self._row_values(self.PRESENCE_ENTITY, presence[presence_id]))
+
+    def get_presence(self, guest_id: str, checkpoint_id: str) -> Optional[Dict]:
+        key = os.path.abspath(self.db_path)
+        if key not in _PRESENCE_CHECKED:
+            # Databases created before the presence table existed (or filled by
+            # an older migration) get it built once from the logs.
+            with self.lock:
+                table = self._table(self.PRESENCE_ENTITY)
+                empty = self.conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None
+            if empty:
+                self.rebuild_presence()
+            _PRESENCE_CHECKED.add(key)
+        return super().get_presence(guest_id, checkpoint_id)
+
+    def load_activity_logs(self, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                           guest_id: Optional[str] = None,
+                           checkpoint_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        # Timestamps are stored as UTC ISO strings, so date bounds map to
+        # lexicographic range comparisons that can use idx_activity_logs_timestamp.
+        clauses, params = [], []
+        if start_date is not None:
+            clauses.append("timestamp >= ?")
+            params.append(start_date.isoformat())
+        if end_date is not None:
+            clauses.append("timestamp < ?")
+            params.append((end_date + timedelta(days=1)).isoformat())
+        if guest_id is not None:
+            clauses.append("guest_id = ?")
+            params.append(guest_id)
+        if checkpoint_id is not None:
+            clauses.append("checkpoint_id = ?")
+            params.append(checkpoint_id)
+        return self._select("activity_logs", " AND ".join(clauses), tuple(params))
@@ -1,66 +1,101 @@
+import atexit
 import json
+import logging
 import os
+import queue
 import threading
-from typing import List, Dict, Any, Optional
-from datetime import datetime
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime, date
 import pytz
 
-class JSONStorage:
-    def __init__(self, data_dir: str = "data"):
-        self.data_dir = data_dir
-        self.lock = threading.Lock()
-        if not os.path.exists(self.data_dir):
-            os.makedirs(self.data_dir)
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows: fall back to in-process locking only
+    fcntl = None
 
-    def _get_file_path(self, entity_type: str) -> str:
-        return os.path.join(self.data_dir, f"{entity_type}.json")
+logger = logging.getLogger(__name__)
+
+# Lock and parsed-entity cache shared by every JSONStorage instance pointing at
+# the same data directory. Streamlit re-executes page scripts (and therefore
+# re-creates JSONStorage) on every rerun, so per-instance state would be lost.
+_SHARED_STATE: Dict[str, Dict[str, Any]] = {}
+_SHARED_STATE_LOCK = threading.Lock()
+
+
+def _get_shared_state(data_dir: str) -> Dict[str, Any]:
+    key = os.path.abspath(data_dir)
+    with _SHARED_STATE_LOCK:
+        if key not in _SHARED_STATE:
+            _SHARED_STATE[key] = {"lock": threading.RLock(), "cache": {}, "flock_depth": 0}
+        return _SHARED_STATE[key]
+
+
+def _normalize(value: Optional[str]) -> str:
+    return (value or "").strip().lower()
+
+
+class BaseStorage:
+    """
+    Backend-independent storage helpers. Subclasses implement the CRUD
+    primitives (load, save, add, update, delete, get_by_id).
+    """
+    ENTITY_TYPES = ("checkpoints", "guests", "activity_logs", "admin_settings", "admin_credentials")
+
+    # Secondary indexes over active (not soft-deleted) records:
+    # entity_type -> {index_name: key function applied to a record}
+    SECONDARY_INDEXES = {
+        "guests": {
+            "email": lambda g: _normalize(g.get("email")),
+            "name_email": lambda g: (_normalize(g.get("name")), _normalize(g.get("email"))),
+        },
+        "checkpoints": {
+            "name": lambda c: c.get("name"),
+        },
+    }
 
     def load(self, entity_type: str) -> List[Dict[str, Any]]:
-        file_path = self._get_file_path(entity_type)
-        with self.lock:
-            if not os.path.exists(file_path):
-                return []
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, IOError):
-                return []
+        raise NotImplementedError
 
     def save(self, entity_type: str, data: List[Dict[str, Any]]):
-        file_path = self._get_file_path(entity_type)
-        with self.lock:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+        raise NotImplementedError
 
     def add(self, entity_type: str, entity: Dict[str, Any]):
-        data = self.load(entity_type)
-        data.append(entity)
-        self.save(entity_type, data)
+        raise NotImplementedError
+
+    def add_many(self, entity_type: str, entities: List[Dict[str, Any]]):
+        for entity in entities:
+            self.add(entity_type, entity)
 
     def update(self, entity_type: str, entity_id: str, updates: Dict[str, Any]):
-        data = self.load(entity_type)
-        updated = False
-        for i, item in enumerate(data):
-            if item.get('id') == entity_id:
-                data[i].update(updates)
-                data[i]['updated_at'] = datetime.now(pytz.UTC).isoformat()
-                updated = True
-                break
-        if updated:
-            self.save(entity_type, data)
+        raise NotImplementedError
 
     def delete(self, entity_type: str, entity_id: str):
-        # Physical delete - use with caution
-        data = self.load(entity_type)
-        data = [item for item in data if item.get('id') != entity_id]
-        self.save(entity_type, data)
+        raise NotImplementedError
 
     def get_by_id(self, entity_type: str, entity_id: str) -> Optional[Dict]:
-        data = self.load(entity_type)
-        for item in data:
-            if item.get('id') == entity_id:
-                return item
-        return None
+        raise NotImplementedError
+
+    def find_unstored(self, entity_type: str, entities: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Entities whose id is not stored yet (e.g. after a partially failed add_many)."""
+        return [entity for entity in entities if self.get_by_id(entity_type, entity.get('id')) is None]
+
+    def advance_qr_sequence(self, checkpoint_id: str, sequence: int) -> int:
+        """
+        Raise a checkpoint's current_qr_sequence to `sequence`, never lowering
+        it, and return the stored value. Backends override this to make the
+        read-compare-write atomic across server processes.
+        """
+        checkpoint = self.get_by_id("checkpoints", checkpoint_id)
+        if checkpoint is None:
+            return sequence
+        stored = checkpoint.get("current_qr_sequence", 0)
+        if sequence <= stored:
+            return stored
+        self.update("checkpoints", checkpoint_id, {"current_qr_sequence": sequence})
+        return sequence
 
     # Soft Delete helpers
     def soft_delete_checkpoint(self, checkpoint_id: str):
@@ -89,6 +124,110 @@ class JSONStorage:
         data = self.load("guests")
         return [item for item in data if item.get('deleted_at') is None]
 
+    def load_activity_logs(self, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                           guest_id: Optional[str] = None,
+                           checkpoint_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Load activity logs filtered by (UTC) timestamp date range and optionally
+        by guest/checkpoint. Both date bounds are inclusive.
+        """
+        return self._filter_logs(self.load("activity_logs"), start_date, end_date, guest_id, checkpoint_id)
+
+    @staticmethod
+    def _filter_logs(logs: List[Dict[str, Any]], start_date: Optional[date], end_date: Optional[date],
+                     guest_id: Optional[str], checkpoint_id: Optional[str]) -> List[Dict[str, Any]]:
+        result = []
+        for log in logs:
+            if guest_id is not None and log.get("guest_id") != guest_id:
+                continue
+            if checkpoint_id is not None and log.get("checkpoint_id") != checkpoint_id:
+                continue
+            if start_date is not None or end_date is not None:
+                try:
+                    log_date = datetime.fromisoformat(log["timestamp"]).date()
+                except (KeyError, ValueError):
+                    continue
+                if start_date is not None and log_date < start_date:
+                    continue
+                if end_date is not None and log_date > end_date:
+                    continue
+            result.append(log)
+        return result
+
+    # Secondary index lookups
+    def _find_ids(self, entity_type: str, index_name: str, key: Any) -> List[str]:
+        """Ids of active records whose index key equals key. Backends override with indexed lookups."""
+        key_func = self.SECONDARY_INDEXES[entity_type][index_name]
+        return [item["id"] for item in self.load(entity_type)
+                if item.get('deleted_at') is None and key_func(item) == key]
+
+    def find_guest_ids_by_email(self, email: str) -> List[str]:
+        """Active guests with this email (case-insensitive, surrounding spaces ignored)."""
+        return self._find_ids("guests", "email", _normalize(email))
+
+    def find_guest_ids_by_name_email(self, name: str, email: str) -> List[str]:
+        """Active guests with this name and email (both case-insensitive)."""
+        return self._find_ids("guests", "name_email", (_normalize(name), _normalize(email)))
+
+    def find_checkpoint_ids_by_name(self, name: str) -> List[str]:
+        """Active checkpoints with exactly this name."""
+        return self._find_ids("checkpoints", "name", name)
+
+    # Presence: last successful action per (guest, checkpoint), maintained on
+    # every activity log write so check-out validation never scans the logs.
+    PRESENCE_ENTITY = "presence"
+
+    @staticmethod
+    def _presence_id(guest_id: str, checkpoint_id: str) -> str:
+        return f"{guest_id}:{checkpoint_id}"
+
+    @classmethod
+    def _apply_presence(cls, presence: Dict[str, Dict[str, Any]], logs: List[Dict[str, Any]]) -> bool:
+        """Fold successful logs into presence (presence id -> record). Returns True if anything changed."""
+        changed = False
+        for log in logs:
+            if log.get("status") != "success":
+                continue
+            presence_id = cls._presence_id(log.get("guest_id"), log.get("checkpoint_id"))
+            current = presence.get(presence_id)
+            if current is not None and current.get("timestamp", "") > log.get("timestamp", ""):
+                continue
+            presence[presence_id] = {
+                "id": presence_id,
+                "guest_id": log.get("guest_id"),
+                "checkpoint_id": log.get("checkpoint_id"),
+                "action": log.get("action"),
+                "timestamp": log.get("timestamp"),
+                "log_id": log.get("id"),
+            }
+            changed = True
+        return changed
+
+    def get_presence(self, guest_id: str, checkpoint_id: str) -> Optional[Dict]:
+        """Last successful activity of a guest at a checkpoint, or None."""
+        return self.get_by_id(self.PRESENCE_ENTITY, self._presence_id(guest_id, checkpoint_id))
+
+    def rebuild_presence(self):
+        """Recompute the presence table from the full activity log."""
+        presence: Dict[str, Dict[str, Any]] = {}
+        self._apply_presence(presence, self.load("activity_logs"))
+        self.save(self.PRESENCE_ENTITY, list(presence.values()))
+
+    # Session token ids (jti) that may no longer be used: revoked on Lock or
+    # consumed by a resume. Kept until the token would have expired anyway,
+    # and shared by every server process through storage.
+    REVOKED_TOKENS_ENTITY = "revoked_tokens"
+
+    def revoke_token_id(self, jti: str, exp: float) -> bool:
+        """
+        Record a token id as used. Returns False if it already was, so a
+        single-use token can be consumed at most once. Expired ids are pruned.
+        """
+        raise NotImplementedError
+
+    def is_token_id_revoked(self, jti: str) -> bool:
+        return self.get_by_id(self.REVOKED_TOKENS_ENTITY, jti) is not None
+
     # Admin Settings Singleton helper
     def load_admin_settings(self) -> Dict[str, Any]:
         data = self.load("admin_settings")
@@ -112,3 +251,948 @@ class JSONStorage:
         # credentials_dict should contain 'username' and 'password_hash'
         credentials_dict['updated_at'] = datetime.now(pytz.UTC).isoformat()
         self.save("admin_credentials", [credentials_dict])
+
+
+class JSONStorage(BaseStorage):
+    # Append-only entities are stored as JSON Lines (one record per line) so
+    # that add() costs one appended line instead of a full file rewrite, and
+    # are partitioned by day (data/<entity>/YYYY-MM-DD.jsonl) so date-range
+    # reads only open the partitions they need.
+    LOG_ENTITIES = ("activity_logs",)
+    UNDATED_PARTITION = "undated"
+    # Only the newest day partitions (where scans land and reports usually
+    # look) are kept in the in-process cache. Older ones are read on demand
+    # and dropped, so a full-history scan never pins the whole log in RAM.
+    PARTITION_CACHE_DAYS = 31
+
+    def __init__(self, data_dir: str = "data"):
+        self.data_dir = data_dir
+        self._state = _get_shared_state(data_dir)
+        self.lock = self._state["lock"]
+        # cache key -> {"stat": (ino, mtime_ns, size), "data": [...], "index": {id: item}}
+        # Keys are the entity type, or "<entity>/<partition>" for log partitions.
+        self._cache: Dict[str, Dict[str, Any]] = self._state["cache"]
+        self._lock_path = os.path.join(self.data_dir, ".storage.lock")
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+    def _is_log_entity(self, entity_type: str) -> bool:
+        return entity_type in self.LOG_ENTITIES
+
+    def _get_file_path(self, entity_type: str) -> str:
+        return os.path.join(self.data_dir, f"{entity_type}.json")
+
+    def _get_partition_dir(self, entity_type: str) -> str:
+        return os.path.join(self.data_dir, entity_type)
+
+    def _get_partition_path(self, entity_type: str, partition: str) -> str:
+        return os.path.join(self._get_partition_dir(entity_type), f"{partition}.jsonl")
+
+    def _partition_for(self, entity: Dict[str, Any]) -> str:
+        """Day partition of a log record, using the same date as load_activity_logs filters on."""
+        try:
+            return datetime.fromisoformat(entity["timestamp"]).date().isoformat()
+        except (KeyError, TypeError, ValueError):
+            return self.UNDATED_PARTITION
+
+    def _group_by_partition(self, entities: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for entity in entities:
+            groups.setdefault(self._partition_for(entity), []).append(entity)
+        return groups
+
+    def _list_partitions(self, entity_type: str) -> List[str]:
+        try:
+            names = os.listdir(self._get_partition_dir(entity_type))
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len(".jsonl")] for name in names if name.endswith(".jsonl"))
+
+    @contextmanager
+    def _write_lock(self):
+        """
+        Hold the in-process lock plus an exclusive flock on data_dir/.storage.lock
+        so read-modify-write cycles are serialised across server processes.
+        Re-entrant within a process: only the outermost call takes the flock.
+        """
+        with self.lock:
+            fd = None
+            if fcntl is not None and self._state["flock_depth"] == 0:
+                fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            self._state["flock_depth"] += 1
+            try:
+                yield
+            finally:
+                self._state["flock_depth"] -= 1
+                if fd is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                    os.close(fd)
+
+    @staticmethod
+    def _atomic_write(file_path: str, data: List[Dict[str, Any]], jsonl: bool):
+        """
+        Write to a temp file in the same directory, fsync it and os.replace it
+        over the target, so readers and crashes never observe a partial file.
+        """
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                if jsonl:
+                    for item in data:
+                        f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                else:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def _append_jsonl(file_path: str, entities: List[Dict[str, Any]]):
+        lines = "".join(json.dumps(entity, ensure_ascii=False) + "\n" for entity in entities)
+        with open(file_path, 'a+b') as f:
+            # Terminate a torn last line left by a crash so these records stay parseable
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    lines = "\n" + lines
+            f.write(lines.encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _migrate_log_entity(self, entity_type: str):
+        """
+        One-shot migration of a legacy single-file log (JSON array
+        `<entity>.json` or JSON Lines `<entity>.jsonl`) into day partitions.
+        Legacy files are kept with a `.migrated` suffix.
+        """
+        legacy_paths = [
+            os.path.join(self.data_dir, f"{entity_type}.json"),
+            os.path.join(self.data_dir, f"{entity_type}.jsonl"),
+        ]
+        if not any(os.path.exists(path) for path in legacy_paths):
+            return
+        with self._write_lock():
+            data = []
+            for path in legacy_paths:
+                # Re-check: another process may have migrated while we waited
+                if os.path.exists(path):
+                    data.extend(self._read_file(path, jsonl=path.endswith(".jsonl")))
+            os.makedirs(self._get_partition_dir(entity_type), exist_ok=True)
+            for partition, group in self._group_by_partition(data).items():
+                file_path = self._get_partition_path(entity_type, partition)
+                # Merge with (and de-duplicate against) an interrupted earlier run
+                existing = self._read_file(file_path, jsonl=True) if os.path.exists(file_path) else []
+                existing_ids = {item.get('id') for item in existing}
+                merged = existing + [item for item in group if item.get('id') not in existing_ids]
+                self._atomic_write(file_path, merged, jsonl=True)
+                self._cache.pop(f"{entity_type}/{partition}", None)
+            for path in legacy_paths:
+                if os.path.exists(path):
+                    os.replace(path, f"{path}.migrated")
+
+    @staticmethod
+    def _read_jsonl(file_path: str) -> List[Dict[str, Any]]:
+        data = []
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        data.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Skip a torn line (e.g. crash mid-append)
+                        continue
+        except IOError:
+            return []
+        return data
+
+    def _read_file(self, file_path: str, jsonl: bool = False) -> List[Dict[str, Any]]:
+        if not os.path.exists(file_path):
+            return []
+        if jsonl:
+            return self._read_jsonl(file_path)
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError):
+            return []
+
+    # --- In-process cache ---
+
+    @staticmethod
+    def _stat_key(file_path: str) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        # st_ino catches os.replace() by another process within one mtime tick
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    # Attempts at a read that no concurrent write overlaps before giving up on caching it
+    CACHE_READ_ATTEMPTS = 3
+
+    @staticmethod
+    def _make_entry(stat: Optional[Tuple[int, int, int]], data: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {
+            "stat": stat,
+            "data": data,
+            "index": {item.get('id'): item for item in data},
+        }
+
+    def _set_cache(self, key: str, file_path: str, data: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Cache data just written to file_path. Only valid under the write lock:
+        no other writer can touch the file between our write and this stat.
+        """
+        entry = self._make_entry(self._stat_key(file_path), data)
+        self._cache[key] = entry
+        return entry
+
+    def _read_entry(self, key: str, file_path: str, jsonl: bool) -> Dict[str, Any]:
+        """
+        Parse a file and cache it under the stat taken *before* the read. If
+        the file changed while being read, the stats before and after differ
+        and the read is retried; a read that keeps racing with writers is
+        returned uncached so a stale parse can never be pinned under a
+        current stat key.
+        """
+        for _ in range(self.CACHE_READ_ATTEMPTS):
+            before = self._stat_key(file_path)
+            data = self._read_file(file_path, jsonl)
+            if self._stat_key(file_path) == before:
+                entry = self._make_entry(before, data)
+                self._cache[key] = entry
+                return entry
+        self._cache.pop(key, None)
+        return self._make_entry(None, data)
+
+    def _get_cached(self, key: str, file_path: str, jsonl: bool) -> Dict[str, Any]:
+        """
+        Return the cached entry for a file, reparsing it only when its
+        inode/mtime/size changed (e.g. written by another process).
+        Must be called with self.lock held.
+        """
+        entry = self._cache.get(key)
+        if entry is None or entry["stat"] is None or entry["stat"] != self._stat_key(file_path):
+            entry = self._read_entry(key, file_path, jsonl)
+        return entry
+
+    def _get_entry(self, entity_type: str, reload: bool = False) -> Dict[str, Any]:
+        """
+        Cached entry of a single-file entity. reload=True re-reads it from
+        disk: read-modify-write cycles (under the write lock) use it so they
+        never build on a cached copy, whatever the cache believes.
+        """
+        file_path = self._get_file_path(entity_type)
+        if reload:
+            return self._read_entry(entity_type, file_path, jsonl=False)
+        return self._get_cached(entity_type, file_path, jsonl=False)
+
+    def _get_partition_entry(self, entity_type: str, partition: str, reload: bool = False) -> Dict[str, Any]:
+        key = f"{entity_type}/{partition}"
+        file_path = self._get_partition_path(entity_type, partition)
+        if reload:
+            return self._read_entry(key, file_path, jsonl=True)
+        return self._get_cached(key, file_path, jsonl=True)
+
+    def _cache_window(self, entity_type: str, partitions: List[str]) -> set:
+        """
+        Partitions allowed in the cache: the newest PARTITION_CACHE_DAYS dated
+        ones. Cached partitions that fell out of the window are evicted.
+        """
+        dated = [p for p in partitions if p != self.UNDATED_PARTITION]
+        window = set(dated[-self.PARTITION_CACHE_DAYS:])
+        prefix = f"{entity_type}/"
+        for key in [k for k in self._cache if k.startswith(prefix) and k[len(prefix):] not in window]:
+            del self._cache[key]
+        return window
+
+    def _read_partition(self, entity_type: str, partition: str, window: set) -> Dict[str, Any]:
+        """Entry of one partition: cached inside the window, read and discarded outside it."""
+        if partition in window:
+            return self._get_partition_entry(entity_type, partition)
+        return self._make_entry(None, self._read_file(self._get_partition_path(entity_type, partition), jsonl=True))
+
+    def _newest_first(self, partitions: List[str]) -> List[str]:
+        """Dated partitions newest first, then the undated one."""
+        dated = [p for p in partitions if p != self.UNDATED_PARTITION]
+        return dated[::-1] + [p for p in partitions if p == self.UNDATED_PARTITION]
+
+    def _get_partition_entries(self, entity_type: str, start_date: Optional[date] = None,
+                               end_date: Optional[date] = None) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Return (partition, entry) pairs for a log entity, pruned to partitions
+        overlapping [start_date, end_date]. Must be called with self.lock held.
+        """
+        self._migrate_log_entity(entity_type)
+        partitions = self._list_partitions(entity_type)
+        window = self._cache_window(entity_type, partitions)
+        if start_date is not None or end_date is not None:
+            low = start_date.isoformat() if start_date is not None else ""
+            high = end_date.isoformat() if end_date is not None else "9999-12-31"
+            partitions = [p for p in partitions if p != self.UNDATED_PARTITION and low <= p <= high]
+        return [(p, self._read_partition(entity_type, p, window)) for p in partitions]
+
+    def _find_partition(self, entity_type: str, entity_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        (partition, entry) holding a record, or None. Searched newest first
+        and stopping at the hit: recent logs are the ones looked up by id.
+        """
+        self._migrate_log_entity(entity_type)
+        partitions = self._list_partitions(entity_type)
+        window = self._cache_window(entity_type, partitions)
+        for partition in self._newest_first(partitions):
+            entry = self._read_partition(entity_type, partition, window)
+            if entity_id in entry["index"]:
+                return partition, entry
+        return None
+
+    def invalidate_cache(self, entity_type: Optional[str] = None):
+        with self.lock:
+            if entity_type is None:
+                self._cache.clear()
+            else:
+                for key in list(self._cache):
+                    if key == entity_type or key.startswith(f"{entity_type}/"):
+                        del self._cache[key]
+
+    # --- CRUD ---
+    # Records handed out are shallow copies of the cached ones; callers may
+    # reassign top-level keys freely but should not mutate nested values.
+
+    def load(self, entity_type: str) -> List[Dict[str, Any]]:
+        with self.lock:
+            if self._is_log_entity(entity_type):
+                return [dict(item) for _, entry in self._get_partition_entries(entity_type)
+                        for item in entry["data"]]
+            return [dict(item) for item in self._get_entry(entity_type)["data"]]
+
+    def read_snapshot(self, entity_type: str) -> List[Dict[str, Any]]:
+        """
+        Every record of an entity as it is on disk, for exports. Unlike
+        load(), legacy single-file logs are read in place rather than
+        migrated into partitions, so data_dir is never modified.
+        """
+        if not self._is_log_entity(entity_type):
+            return self._read_file(self._get_file_path(entity_type))
+        data = []
+        for partition in self._list_partitions(entity_type):
+            data.extend(self._read_file(self._get_partition_path(entity_type, partition), jsonl=True))
+        seen = {item.get('id') for item in data}
+        for path in (os.path.join(self.data_dir, f"{entity_type}.json"),
+                     os.path.join(self.data_dir, f"{entity_type}.jsonl")):
+            for item in self._read_file(path, jsonl=path.endswith(".jsonl")):
+                if item.get('id') not in seen:
+                    seen.add(item.get('id'))
+                    data.append(item)
+        return data
+
+    def save(self, entity_type: str, data: List[Dict[str, Any]]):
+        with self._write_lock():
+            if not self._is_log_entity(entity_type):
+                file_path = self._get_file_path(entity_type)
+                self._atomic_write(file_path, data, jsonl=False)
+                self._set_cache(entity_type, file_path, [dict(item) for item in data])
+                return
+
+            self._migrate_log_entity(entity_type)
+            os.makedirs(self._get_partition_dir(entity_type), exist_ok=True)
+            groups = self._group_by_partition(data)
+            for partition in self._list_partitions(entity_type):
+                if partition not in groups:
+                    os.remove(self._get_partition_path(entity_type, partition))
+                    self._cache.pop(f"{entity_type}/{partition}", None)
+            window = self._cache_window(entity_type, sorted(groups))
+            for partition, group in groups.items():
+                self._save_partition(entity_type, partition, group, window)
+            self._on_logs_rewritten(entity_type)
+
+    def _save_partition(self, entity_type: str, partition: str, data: List[Dict[str, Any]],
+                        window: Optional[set] = None):
+        file_path = self._get_partition_path(entity_type, partition)
+        self._atomic_write(file_path, data, jsonl=True)
+        if window is None:
+            window = self._cache_window(entity_type, self._list_partitions(entity_type))
+        if partition in window:
+            self._set_cache(f"{entity_type}/{partition}", file_path, [dict(item) for item in data])
+
+    def add(self, entity_type: str, entity: Dict[str, Any]):
+        self.add_many(entity_type, [entity])
+
+    def add_many(self, entity_type: str, entities: List[Dict[str, Any]]):
+        """Add several records with a single write per touched file."""
+        if not entities:
+            return
+        with self._write_lock():
+            if not self._is_log_entity(entity_type):
+                data = self._get_entry(entity_type, reload=True)["data"] + list(entities)
+                self.save(entity_type, data)
+                return
+
+            # Append lines to the day partitions instead of rewriting history
+            self._migrate_log_entity(entity_type)
+            os.makedirs(self._get_partition_dir(entity_type), exist_ok=True)
+            for partition, group in self._group_by_partition(entities).items():
+                key = f"{entity_type}/{partition}"
+                file_path = self._get_partition_path(entity_type, partition)
+                entry = self._cache.get(key)
+                fresh = entry is not None and entry["stat"] == self._stat_key(file_path)
+                self._append_jsonl(file_path, group)
+                if fresh:
+                    for entity in group:
+                        item = dict(entity)
+                        entry["data"].append(item)
+                        entry["index"][item.get('id')] = item
+                    entry.pop("secondary", None)
+                    entry["stat"] = self._stat_key(file_path)
+                else:
+                    self._cache.pop(key, None)
+            if entity_type == "activity_logs":
+                self._update_presence(entities)
+
+    @staticmethod
+    def _apply_update(data: List[Dict[str, Any]], entity_id: str,
+                      updates: Dict[str, Any]) -> List[Dict[str, Any]]:
+        result = []
+        for item in data:
+            if item.get('id') == entity_id:
+                item = dict(item)
+                item.update(updates)
+                item['updated_at'] = datetime.now(pytz.UTC).isoformat()
+            result.append(item)
+        return result
+
+    def update(self, entity_type: str, entity_id: str, updates: Dict[str, Any]):
+        with self._write_lock():
+            if self._is_log_entity(entity_type):
+                # Only the partition holding the record is rewritten
+                found = self._find_partition(entity_type, entity_id)
+                if found is None:
+                    return
+                partition = found[0]
+                # Re-read from disk: the write builds on the file, never on a cached copy
+                data = self._read_file(self._get_partition_path(entity_type, partition), jsonl=True)
+                updated = self._apply_update(data, entity_id, updates)
+                self._save_partition(entity_type, partition, updated)
+                self._on_log_changed(entity_type, [item for item in data + updated if item.get('id') == entity_id])
+                return
+
+            entry = self._get_entry(entity_type, reload=True)
+            if entity_id not in entry["index"]:
+                return
+            self.save(entity_type, self._apply_update(entry["data"], entity_id, updates))
+
+    def delete(self, entity_type: str, entity_id: str):
+        # Physical delete - use with caution
+        with self._write_lock():
+            if self._is_log_entity(entity_type):
+                found = self._find_partition(entity_type, entity_id)
+                if found is None:
+                    return
+                partition = found[0]
+                data = self._read_file(self._get_partition_path(entity_type, partition), jsonl=True)
+                self._save_partition(entity_type, partition,
+                                     [item for item in data if item.get('id') != entity_id])
+                self._on_log_changed(entity_type, [item for item in data if item.get('id') == entity_id])
+                return
+
+            data = [item for item in self._get_entry(entity_type, reload=True)["data"] if item.get('id') != entity_id]
+            self.save(entity_type, data)
+
+    def advance_qr_sequence(self, checkpoint_id: str, sequence: int) -> int:
+        # Compare against the file on disk under the flock, so a display in
+        # another process that is already ahead is never rolled back
+        with self._write_lock():
+            checkpoint = self._get_entry("checkpoints", reload=True)["index"].get(checkpoint_id)
+            if checkpoint is None:
+                return sequence
+            stored = checkpoint.get("current_qr_sequence", 0)
+            if sequence <= stored:
+                return stored
+            self.save("checkpoints", self._apply_update(
+                self._get_entry("checkpoints")["data"], checkpoint_id, {"current_qr_sequence": sequence}
+            ))
+            return sequence
+
+    def revoke_token_id(self, jti: str, exp: float) -> bool:
+        with self._write_lock():
+            entry = self._get_entry(self.REVOKED_TOKENS_ENTITY, reload=True)
+            if jti in entry["index"]:
+                return False
+            now = time.time()
+            data = [item for item in entry["data"] if item.get("exp", 0) >= now]
+            data.append({"id": jti, "exp": exp})
+            self.save(self.REVOKED_TOKENS_ENTITY, data)
+            return True
+
+    def get_by_id(self, entity_type: str, entity_id: str) -> Optional[Dict]:
+        with self.lock:
+            if self._is_log_entity(entity_type):
+                found = self._find_partition(entity_type, entity_id)
+                item = found[1]["index"][entity_id] if found is not None else None
+            else:
+                item = self._get_entry(entity_type)["index"].get(entity_id)
+            return dict(item) if item is not None else None
+
+    def find_unstored(self, entity_type: str, entities: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not self._is_log_entity(entity_type):
+            return super().find_unstored(entity_type, entities)
+        # A log can only be in the day partition its timestamp maps to, so
+        # only the batch's own partitions are opened, not the whole history
+        with self.lock:
+            self._migrate_log_entity(entity_type)
+            window = self._cache_window(entity_type, self._list_partitions(entity_type))
+            stored = set()
+            for partition in self._group_by_partition(entities):
+                stored.update(self._read_partition(entity_type, partition, window)["index"])
+        return [entity for entity in entities if entity.get('id') not in stored]
+
+    def get_active_checkpoints(self) -> List[Dict]:
+        with self.lock:
+            data = self._get_entry("checkpoints")["data"]
+            return [dict(item) for item in data if item.get('deleted_at') is None]
+
+    def get_active_guests(self) -> List[Dict]:
+        with self.lock:
+            data = self._get_entry("guests")["data"]
+            return [dict(item) for item in data if item.get('deleted_at') is None]
+
+    def _find_ids(self, entity_type: str, index_name: str, key: Any) -> List[str]:
+        with self.lock:
+            entry = self._get_entry(entity_type)
+            # Built lazily once per cache entry; any write replaces the entry,
+            # so the index can never drift from the records it was built from.
+            secondary = entry.setdefault("secondary", {})
+            if index_name not in secondary:
+                key_func = self.SECONDARY_INDEXES[entity_type][index_name]
+                index: Dict[Any, List[str]] = {}
+                for item in entry["data"]:
+                    if item.get('deleted_at') is None:
+                        index.setdefault(key_func(item), []).append(item.get('id'))
+                secondary[index_name] = index
+            return list(secondary[index_name].get(key, []))
+
+    # --- Presence ---
+    # The presence table is an append-only journal (data/presence.jsonl): a
+    # scan appends the records it changes and replay is last-wins per id, so
+    # a write costs one appended line instead of rewriting every guest's
+    # record. The cached index advances by reading only the bytes past its
+    # last offset, and the journal is compacted once it holds more than
+    # PRESENCE_COMPACT_RATIO lines per record.
+    PRESENCE_COMPACT_RATIO = 2
+    PRESENCE_COMPACT_MIN_LINES = 1000
+
+    def _get_presence_path(self) -> str:
+        return os.path.join(self.data_dir, f"{self.PRESENCE_ENTITY}.jsonl")
+
+    def _presence_entry(self) -> Dict[str, Any]:
+        """
+        Cached journal replay {"ino", "offset", "lines", "index"}, caught up
+        with the file on disk. A new inode (compaction or rebuild by any
+        process) or a shrunk file triggers a full replay; otherwise only the
+        appended tail is read. Must be called with self.lock held.
+        """
+        key = f"{self.PRESENCE_ENTITY}/journal"
+        entry = self._cache.get(key)
+        try:
+            f = open(self._get_presence_path(), 'rb')
+        except FileNotFoundError:
+            entry = {"ino": None, "offset": 0, "lines": 0, "index": {}}
+            self._cache[key] = entry
+            return entry
+        with f:
+            st = os.fstat(f.fileno())
+            if entry is None or entry["ino"] != st.st_ino or st.st_size < entry["offset"]:
+                entry = {"ino": st.st_ino, "offset": 0, "lines": 0, "index": {}}
+                self._cache[key] = entry
+            if st.st_size == entry["offset"]:
+                return entry
+            f.seek(entry["offset"])
+            chunk = f.read()
+        # Only consume complete lines: an append may still be in progress
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Torn line from a crash mid-append
+            if record.get("deleted"):
+                entry["index"].pop(record.get("id"), None)  # Tombstone: no successful log left
+            else:
+                entry["index"][record.get("id")] = record
+            entry["lines"] += 1
+        entry["offset"] += end
+        return entry
+
+    def _write_presence(self, records: List[Dict[str, Any]]):
+        """Atomically replace the journal with one line per record. Called with the write lock held."""
+        file_path = self._get_presence_path()
+        self._atomic_write(file_path, records, jsonl=True)
+        st = os.stat(file_path)
+        self._cache[f"{self.PRESENCE_ENTITY}/journal"] = {
+            "ino": st.st_ino,
+            "offset": st.st_size,
+            "lines": len(records),
+            "index": {item.get("id"): dict(item) for item in records},
+        }
+
+    def _ensure_presence(self):
+        """
+        Create the presence journal if it does not exist yet: from a legacy
+        presence.json (kept with a `.migrated` suffix), else from the logs.
+        """
+        if os.path.exists(self._get_presence_path()):
+            return
+        with self._write_lock():
+            if os.path.exists(self._get_presence_path()):
+                return
+            legacy_path = self._get_file_path(self.PRESENCE_ENTITY)
+            if os.path.exists(legacy_path):
+                self._write_presence(self._read_file(legacy_path))
+                os.replace(legacy_path, f"{legacy_path}.migrated")
+                self._cache.pop(self.PRESENCE_ENTITY, None)
+            else:
+                self.rebuild_presence()
+
+    def rebuild_presence(self):
+        """Recompute the presence journal from the full activity log."""
+        with self._write_lock():
+            presence: Dict[str, Dict[str, Any]] = {}
+            self._apply_presence(presence, self.load("activity_logs"))
+            self._write_presence(list(presence.values()))
+
+    def _update_presence(self, logs: List[Dict[str, Any]]):
+        """Append the presence records these new logs change. Called with the write lock held."""
+        self._ensure_presence()
+        # Under the flock no other process can append, so the tail read
+        # brings the index fully up to date before we compare against it
+        entry = self._presence_entry()
+        presence = {}
+        for log in logs:
+            presence_id = self._presence_id(log.get("guest_id"), log.get("checkpoint_id"))
+            if presence_id in entry["index"]:
+                presence[presence_id] = entry["index"][presence_id]
+        before = {k: v.get("log_id") for k, v in presence.items()}
+        if not self._apply_presence(presence, logs):
+            return
+        self._append_presence([v for k, v in presence.items() if before.get(k) != v.get("log_id")])
+
+    def _append_presence(self, records: List[Dict[str, Any]]):
+        """Append records (or tombstones) to the journal, compacting it when due. Called with the write lock held."""
+        if not records:
+            return
+        self._append_jsonl(self._get_presence_path(), records)
+        entry = self._presence_entry()
+        if entry["lines"] > max(self.PRESENCE_COMPACT_RATIO * len(entry["index"]), self.PRESENCE_COMPACT_MIN_LINES):
+            self._write_presence(list(entry["index"].values()))
+
+    def _on_logs_rewritten(self, entity_type: str):
+        # Rewrites (rather than appends) may drop or alter logs: recompute from scratch
+        if entity_type == "activity_logs":
+            self.rebuild_presence()
+
+    def _on_log_changed(self, entity_type: str, versions: List[Dict[str, Any]]):
+        """
+        A single log was edited or deleted (versions: its old and new
+        records). Only the presence of the (guest, checkpoint) pairs involved
+        can change, so only those are recomputed: partitions are scanned
+        newest first until each pair's latest successful log is found.
+        Called with the write lock held.
+        """
+        if entity_type != "activity_logs" or not versions:
+            return
+        self._ensure_presence()
+        affected = {self._presence_id(v.get("guest_id"), v.get("checkpoint_id")) for v in versions}
+        pending = set(affected)
+        latest: Dict[str, Dict[str, Any]] = {}
+        partitions = self._list_partitions(entity_type)
+        window = self._cache_window(entity_type, partitions)
+        for partition in self._newest_first(partitions):
+            if not pending:
+                break  # Older partitions only hold older logs
+            data = self._read_partition(entity_type, partition, window)["data"]
+            self._apply_presence(latest, [item for item in data if self._presence_id(
+                item.get("guest_id"), item.get("checkpoint_id")) in pending])
+            pending -= set(latest)
+        index = self._presence_entry()["index"]
+        changes = []
+        for presence_id in affected:
+            if presence_id in latest:
+                if index.get(presence_id) != latest[presence_id]:
+                    changes.append(latest[presence_id])
+            elif presence_id in index:
+                changes.append({"id": presence_id, "deleted": True})
+        self._append_presence(changes)
+
+    def get_presence(self, guest_id: str, checkpoint_id: str) -> Optional[Dict]:
+        self._ensure_presence()
+        with self.lock:
+            item = self._presence_entry()["index"].get(self._presence_id(guest_id, checkpoint_id))
+            return dict(item) if item is not None else None
+
+    def load_activity_logs(self, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                           guest_id: Optional[str] = None,
+                           checkpoint_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        # Partition pruning: only day files within [start_date, end_date] are opened
+        with self.lock:
+            logs = [dict(item) for _, entry in self._get_partition_entries("activity_logs", start_date, end_date)
+                    for item in entry["data"]]
+        return self._filter_logs(logs, start_date, end_date, guest_id, checkpoint_id)
+
+
+def get_storage() -> BaseStorage:
+    """
+    Return the storage backend selected by the QR_STORAGE_BACKEND environment
+    variable: "json" (default) or "sqlite" (database at QR_SQLITE_PATH).
+    """
+    backend = os.getenv("QR_STORAGE_BACKEND", "json").strip().lower()
+    if backend == "sqlite":
+        from core.sqlite_storage import SQLiteStorage
+        return SQLiteStorage(os.getenv("QR_SQLITE_PATH", os.path.join("data", "qr_in_out.db")))
+    if backend != "json":
+        raise ValueError(f"Unknown QR_STORAGE_BACKEND: {backend!r} (expected 'json' or 'sqlite')")
+    return JSONStorage()
+
+
+class ActivityLogWriter:
+    """
+    Write-behind queue for activity log inserts. A background thread drains a
+    bounded queue and writes up to `batch_size` logs per storage.add_many()
+    call, flushing at least every `flush_interval` seconds.
+
+    durability="sync" writes in the caller's thread (previous behaviour);
+    "async" enqueues and returns immediately. submit(..., sync=True) forces
+    a synchronous commit for a single log regardless of the mode.
+
+    A failed background write is retried `max_retries` times with
+    exponential backoff (skipping logs a partial write already stored). If
+    it still fails, the batch is appended to `spill_path` (JSON Lines) and
+    written back to storage by replay_spilled(), which the writer runs when
+    idle, on close and at startup. Nothing acknowledged to a guest is
+    silently dropped; stats() exposes the pending/failed counts.
+    """
+    DURABILITY_MODES = ("sync", "async")
+    REPLAY_INTERVAL = 30  # seconds between idle attempts to replay spilled logs
+
+    def __init__(self, storage: BaseStorage, entity_type: str = "activity_logs",
+                 durability: str = "sync", batch_size: int = 100,
+                 flush_interval: float = 0.5, max_queue_size: int = 10000,
+                 max_retries: int = 3, retry_backoff: float = 0.5,
+                 spill_path: Optional[str] = None):
+        if durability not in self.DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability!r} (expected 'sync' or 'async')")
+        self.storage = storage
+        self.entity_type = entity_type
+        self.durability = durability
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.spill_path = spill_path or os.path.join("data", f"{entity_type}.pending.jsonl")
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue_size)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._counts = {"written": 0, "retries": 0, "spilled": 0, "replayed": 0, "lost": 0}
+        self._next_replay = 0.0
+
+    def submit(self, log: Dict[str, Any], sync: Optional[bool] = None):
+        if sync is None:
+            sync = self.durability == "sync"
+        if sync or self._stop.is_set():
+            self.storage.add(self.entity_type, log)
+            self._count("written", 1)
+            return
+        self._ensure_thread()
+        # Blocks when the queue is full, applying back-pressure to producers
+        self._queue.put(log)
+
+    def flush(self):
+        """Block until every log submitted so far has been written (or spilled)."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """Flush pending logs, stop the background thread and replay spilled logs."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        # Anything enqueued after the thread exited
+        while True:
+            batch = self._drain(self.batch_size)
+            if not batch:
+                break
+            self._write_batch(batch)
+        self.replay_spilled()
+
+    def stats(self) -> Dict[str, int]:
+        """Counters plus logs still waiting: queued in memory and spilled to disk."""
+        with self._stats_lock:
+            snapshot = dict(self._counts)
+        snapshot["queued"] = self._queue.qsize()
+        snapshot["spill_pending"] = self._count_spilled()
+        return snapshot
+
+    def _count(self, name: str, value: int):
+        with self._stats_lock:
+            self._counts[name] += value
+
+    def _ensure_thread(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="activity-log-writer", daemon=True)
+                self._thread.start()
+
+    def _drain(self, limit: int) -> List[Dict[str, Any]]:
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _unwritten(self, logs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Logs not yet in storage (a failed add_many may have stored some of them)."""
+        try:
+            return self.storage.find_unstored(self.entity_type, logs)
+        except Exception:
+            return logs
+
+    def _store(self, logs: List[Dict[str, Any]]) -> bool:
+        """add_many with retries and backoff. Returns False if every attempt failed."""
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._count("retries", 1)
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+                logs = self._unwritten(logs)
+                if not logs:
+                    return True
+            try:
+                self.storage.add_many(self.entity_type, logs)
+                self._count("written", len(logs))
+                return True
+            except Exception as e:
+                if attempt < self.max_retries:
+                    logger.warning("Failed to write %d activity log(s) (attempt %d/%d): %s",
+                                   len(logs), attempt + 1, self.max_retries + 1, e)
+                else:
+                    logger.exception("Failed to write %d activity log(s) after %d attempts",
+                                     len(logs), attempt + 1)
+        return False
+
+    def _write_batch(self, batch: List[Dict[str, Any]]):
+        if not batch:
+            return
+        try:
+            if not self._store(batch):
+                self._spill(self._unwritten(batch))
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _spill(self, logs: List[Dict[str, Any]]):
+        if not logs:
+            return
+        try:
+            with self._spill_lock:
+                os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+                JSONStorage._append_jsonl(self.spill_path, logs)
+            self._count("spilled", len(logs))
+            logger.error("Spilled %d activity log(s) to %s for later replay", len(logs), self.spill_path)
+        except Exception:
+            self._count("lost", len(logs))
+            logger.exception("Could not spill %d activity log(s); they are lost", len(logs))
+
+    def _count_spilled(self) -> int:
+        try:
+            with open(self.spill_path, "rb") as f:
+                return sum(1 for line in f if line.strip())
+        except OSError:
+            return 0
+
+    def replay_spilled(self) -> int:
+        """Write spilled logs back to storage. Returns how many were stored."""
+        with self._spill_lock:
+            if not os.path.exists(self.spill_path):
+                return 0
+            # Claim the file so logs spilled meanwhile go to a fresh one
+            claimed = f"{self.spill_path}.{os.getpid()}.replay"
+            try:
+                os.replace(self.spill_path, claimed)
+            except OSError:
+                return 0
+        logs = self._unwritten(JSONStorage._read_jsonl(claimed))
+        if logs and not self._store(logs):
+            self._spill(self._unwritten(logs))
+            os.remove(claimed)
+            return 0
+        os.remove(claimed)
+        self._count("replayed", len(logs))
+        return len(logs)
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if time.monotonic() >= self._next_replay:
+                    self._next_replay = time.monotonic() + self.REPLAY_INTERVAL
+                    try:
+                        self.replay_spilled()
+                    except Exception:
+                        logger.exception("Failed to replay spilled activity logs")
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception:
+                # Keep the writer alive; _write_batch already spilled what it could
+                logger.exception("Unexpected error writing %d activity log(s)", len(batch))
+
+
+_LOG_WRITER: Optional[ActivityLogWriter] = None
+_LOG_WRITER_LOCK = threading.Lock()
+
+
+def get_log_writer() -> ActivityLogWriter:
+    """
+    Return the process-wide activity log writer. QR_LOG_DURABILITY selects
+    "sync" (default) or "async" (batched write-behind); pending logs are
+    flushed at interpreter shutdown, and logs spilled after failed writes
+    are replayed on startup.
+    """
+    global _LOG_WRITER
+    with _LOG_WRITER_LOCK:
+        if _LOG_WRITER is None:
+            durability = os.getenv("QR_LOG_DURABILITY", "sync").strip().lower()
+            _LOG_WRITER = ActivityLogWriter(get_storage(), durability=durability,
+                                            spill_path=os.getenv("QR_LOG_SPILL_PATH") or None)
+            atexit.register(_LOG_WRITER.close)
+            try:
+                # Logs spilled by a previous run whose storage writes failed
+                _LOG_WRITER.replay_spilled()
+            except Exception:
+                logger.exception("Failed to replay spilled activity logs")
+        return _LOG_WRITER
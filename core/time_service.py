@@ -1,61 +1,254 @@
+import os
+import threading
+import time
 import requests
 import streamlit as st
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import pytz
-from typing import Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Tuple, Optional, Dict, Any, List
+
+
+# --- Reference time sources ---
+
+class TimeSource:
+    """A reference clock. fetch_utc() returns its current UTC time (aware datetime) or raises."""
+    name = "source"
+    label = "Reference Clock"
+
+    def fetch_utc(self) -> datetime:
+        raise NotImplementedError
+
+
+class WorldTimeAPISource(TimeSource):
+    name = "worldtimeapi"
+    label = "World Time API"
+    URL = "http://worldtimeapi.org/api/timezone/Etc/UTC"
+
+    def __init__(self, timeout: float = 3.0):
+        self.timeout = timeout
+
+    def fetch_utc(self) -> datetime:
+        response = requests.get(self.URL, timeout=self.timeout)
+        response.raise_for_status()
+        return datetime.fromisoformat(response.json()["utc_datetime"])
+
+
+class TimeAPISource(TimeSource):
+    name = "timeapi"
+    label = "TimeAPI.io"
+    URL = "https://timeapi.io/api/Time/current/zone?timeZone=UTC"
+
+    def __init__(self, timeout: float = 3.0):
+        self.timeout = timeout
+
+    def fetch_utc(self) -> datetime:
+        response = requests.get(self.URL, timeout=self.timeout)
+        response.raise_for_status()
+        # e.g. "2026-02-05T09:45:38.0000000" (UTC, no offset)
+        return datetime.fromisoformat(response.json()["dateTime"]).replace(tzinfo=timezone.utc)
+
+
+class LocalTimeSource(TimeSource):
+    """
+    Stand-in reference reading this machine's clock, optionally skewed by
+    skew_seconds. No network: for tests and offline deployments.
+    """
+    name = "local"
+    label = "Local Clock"
+
+    def __init__(self, skew_seconds: float = 0.0):
+        self.skew_seconds = skew_seconds
+
+    def fetch_utc(self) -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=self.skew_seconds)
+
+
+TIME_SOURCES = {
+    source.name: source for source in (WorldTimeAPISource, TimeAPISource, LocalTimeSource)
+}
+
+# Re-measure the offset this often (seconds), and retry this soon after a failed attempt
+DEFAULT_SYNC_INTERVAL = 300
+RETRY_AFTER_FAILURE = 30
+
+# Process-wide clock state: one measured anchor answers every timezone.
+#   anchor_utc / anchor_mono: reference UTC epoch seconds at monotonic time anchor_mono
+#   offset: reference minus local wall clock (seconds), rtt: round trip of the measurement
+# A daemon thread ("time-sync") keeps the anchor fresh; readers never wait on the network.
+_CLOCK: Dict[str, Any] = {"sources": None, "sync_interval": None, "anchor": None, "refresher": None}
+_CLOCK_LOCK = threading.Lock()
+_SYNC_LOCK = threading.Lock()
+_WAKE_REFRESHER = threading.Event()
+
+
+def _sources_from_env() -> List[TimeSource]:
+    """QR_TIME_SOURCES: comma-separated names raced against each other (default "worldtimeapi,timeapi")."""
+    names = os.getenv("QR_TIME_SOURCES", "worldtimeapi,timeapi")
+    sources = []
+    for name in (n.strip().lower() for n in names.split(",")):
+        if name not in TIME_SOURCES:
+            raise ValueError(f"Unknown time source: {name!r} (expected one of {', '.join(TIME_SOURCES)})")
+        sources.append(TIME_SOURCES[name]())
+    return sources
+
+
+def _refresh_loop():
+    while True:
+        synced = TimeService.sync()
+        _, sync_interval = TimeService._settings()
+        # Sleep until the next measurement is due, or until configure() wakes us
+        _WAKE_REFRESHER.wait(sync_interval if synced else RETRY_AFTER_FAILURE)
+        _WAKE_REFRESHER.clear()
+
 
 class TimeService:
     @staticmethod
-    @st.cache_data(ttl=60)
+    def configure(sources: Optional[List[TimeSource]] = None, sync_interval: Optional[float] = None):
+        """
+        Replace the reference sources and/or the re-sync interval, drop the
+        current measurement and have the refresher re-measure right away.
+        Without a call they come from QR_TIME_SOURCES and QR_TIME_SYNC_INTERVAL.
+        """
+        with _CLOCK_LOCK:
+            if sources is not None:
+                _CLOCK["sources"] = list(sources)
+            if sync_interval is not None:
+                _CLOCK["sync_interval"] = sync_interval
+            _CLOCK["anchor"] = None
+        _WAKE_REFRESHER.set()
+
+    @staticmethod
+    def _settings() -> Tuple[List[TimeSource], float]:
+        with _CLOCK_LOCK:
+            if _CLOCK["sources"] is None:
+                _CLOCK["sources"] = _sources_from_env()
+            if _CLOCK["sync_interval"] is None:
+                _CLOCK["sync_interval"] = float(os.getenv("QR_TIME_SYNC_INTERVAL", DEFAULT_SYNC_INTERVAL))
+            return _CLOCK["sources"], _CLOCK["sync_interval"]
+
+    @staticmethod
+    def start_refresher():
+        """Start the background refresher thread (idempotent; readers call this on first use)."""
+        TimeService._settings()  # Surface configuration errors to the caller
+        with _CLOCK_LOCK:
+            if _CLOCK["refresher"] is not None:
+                return
+            _CLOCK["refresher"] = threading.Thread(target=_refresh_loop, name="time-sync", daemon=True)
+            _CLOCK["refresher"].start()
+
+    @staticmethod
+    def measure(source: TimeSource) -> Dict[str, Any]:
+        """
+        Read one reference and anchor it to the monotonic clock. The reference
+        is assumed to have been read halfway through the round trip.
+        """
+        start = time.monotonic()
+        reference = source.fetch_utc()
+        end = time.monotonic()
+        rtt = end - start
+        anchor_utc = reference.timestamp() + rtt / 2
+        return {
+            "source": source.name,
+            "label": source.label,
+            "anchor_utc": anchor_utc,
+            "anchor_mono": end,
+            "rtt": rtt,
+            "offset": anchor_utc - time.time(),
+        }
+
+    @staticmethod
+    def sync() -> bool:
+        """
+        Query all sources concurrently and keep the first valid answer.
+        Blocks until then (or until all have failed); normally only the
+        refresher thread calls this. Returns True on success.
+        """
+        sources, _ = TimeService._settings()
+        with _SYNC_LOCK:
+            # Not a context manager: slower sources finish in the background
+            pool = ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="time-source")
+            try:
+                futures = [pool.submit(TimeService.measure, source) for source in sources]
+                for future in as_completed(futures):
+                    try:
+                        anchor = future.result()
+                    except Exception:
+                        continue  # Wait for the next source
+                    with _CLOCK_LOCK:
+                        _CLOCK["anchor"] = anchor
+                    return True
+                return False
+            finally:
+                pool.shutdown(wait=False)
+
+    @staticmethod
+    def get_offset() -> Tuple[float, Optional[float]]:
+        """
+        Last measured offset (seconds to add to the local wall clock) and its
+        age in seconds. Never blocks; (0.0, None) until the first measurement.
+        """
+        TimeService.start_refresher()
+        with _CLOCK_LOCK:
+            anchor = _CLOCK["anchor"]
+        if anchor is None:
+            return 0.0, None
+        return anchor["offset"], time.monotonic() - anchor["anchor_mono"]
+
+    @staticmethod
+    def get_utc_now() -> Tuple[datetime, bool]:
+        """
+        Current UTC time from the last measured anchor (monotonic clock +
+        offset). Never blocks: before the first measurement it returns the
+        local clock. Returns: (aware UTC datetime, is_synchronized)
+        """
+        TimeService.start_refresher()
+        with _CLOCK_LOCK:
+            anchor = _CLOCK["anchor"]
+        if anchor is None:
+            return datetime.now(timezone.utc), False
+        utc_seconds = anchor["anchor_utc"] + (time.monotonic() - anchor["anchor_mono"])
+        return datetime.fromtimestamp(utc_seconds, tz=timezone.utc), True
+
+    @staticmethod
+    def get_sync_info() -> Optional[Dict[str, Any]]:
+        """The current measurement (source, offset, rtt, age in seconds), or None if never synced."""
+        with _CLOCK_LOCK:
+            anchor = _CLOCK["anchor"]
+        if anchor is None:
+            return None
+        return {**anchor, "age": time.monotonic() - anchor["anchor_mono"]}
+
+    @staticmethod
     def get_current_time(timezone_str: str = "Asia/Seoul") -> Tuple[datetime, bool]:
         """
         Get the current time for a given timezone.
-        Attempts to use World Time API first, then falls back to TimeAPI.io, 
-        and finally falls back to server local time.
+        Answered locally from the process-wide measured UTC offset (see
+        get_utc_now); falls back to server local time until a reference
+        source has answered.
         Returns: (datetime object, is_synchronized)
         """
-        # Attempt 1: World Time API
-        try:
-            url = f"http://worldtimeapi.org/api/timezone/{timezone_str}"
-            response = requests.get(url, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                dt_str = data.get("datetime")
-                if dt_str:
-                    return datetime.fromisoformat(dt_str), True
-        except Exception:
-            pass # Try next source
-        
-        # Attempt 2: TimeAPI.io
-        try:
-            url = f"https://timeapi.io/api/Time/current/zone?timeZone={timezone_str}"
-            response = requests.get(url, timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                dt_str = data.get("dateTime")
-                if dt_str:
-                    # timeapi.io dateTime format might need slight adjustment for fromisoformat
-                    # common format: "2026-02-05T09:45:38.0000000"
-                    return datetime.fromisoformat(dt_str).replace(tzinfo=pytz.timezone(timezone_str)), True
-        except Exception:
-            pass # Failure here will lead to server time fallback
-
-        # Fallback to local system time
+        utc_now, is_synced = TimeService.get_utc_now()
         try:
             tz = pytz.timezone(timezone_str)
-            return datetime.now(tz), False
         except Exception:
             # Absolute fallback to UTC if timezone is invalid
-            return datetime.now(pytz.UTC), False
+            tz = pytz.UTC
+        return utc_now.astimezone(tz), is_synced
 
     @staticmethod
     def show_time_sync_status(is_synced: bool, current_time: datetime):
         """
         Display time synchronization status in Streamlit UI.
         """
+        sync_info = TimeService.get_sync_info()
         status_color = "green" if is_synced else "orange"
-        status_text = "Synchronized to World Time API" if is_synced else "Not Synchronized (Using Server Time)"
-        
+        if is_synced and sync_info:
+            status_text = (f"Synchronized to {sync_info['label']} "
+                           f"(offset {sync_info['offset']:+.2f}s, measured {sync_info['age']:.0f}s ago)")
+        else:
+            status_text = "Not Synchronized (Using Server Time)"
+
         st.markdown(f"""
             <div style="padding: 10px; border-radius: 5px; background-color: rgba(0,0,0,0.05); border-left: 5px solid {status_color};">
                 <span style="font-weight: bold; color: {status_color};">Time Status: {status_text}</span><br>
@@ -1,5 +1,318 @@
-from datetime import datetime, time
-from typing import Dict, Tuple, Any, Optional
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+import json
+from typing import Dict, List, Tuple, Any, Optional
+
+import numpy as np
+import pandas as pd
+
+from core.models import WEEKDAYS
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+_DAY_MASK = (1 << MINUTES_PER_DAY) - 1
+
+Window = Tuple[int, int]  # (start, end) minutes since midnight; start > end = overnight
+
+
+def _span(start: int, end: int) -> int:
+    """Bits for minutes [start, end)."""
+    return ((1 << (end - start)) - 1) << start
+
+
+def _parse_window(window: Dict[str, str]) -> Window:
+    start = TimeValidator.parse_time_string(window["start_time"])
+    end = TimeValidator.parse_time_string(window["end_time"])
+    return start.hour * 60 + start.minute, end.hour * 60 + end.minute
+
+
+def _day_bits(windows: List[Window]) -> Tuple[int, int, int, int]:
+    """
+    Minute bitmaps for one day's windows: (own, own_ends, spill, spill_ends).
+    A set bit opens the whole minute; an *_ends bit opens only its first
+    instant (windows include their end time, as HH:MM). spill is the part of
+    overnight windows that falls on the next day.
+    """
+    own = own_ends = spill = spill_ends = 0
+    for start, end in windows:
+        if start > end:
+            own |= _span(start, MINUTES_PER_DAY)
+            spill |= _span(0, end)
+            spill_ends |= 1 << end
+        else:
+            own |= _span(start, end)
+            own_ends |= 1 << end
+    return own, own_ends, spill, spill_ends
+
+
+def _lowest_bit_from(bits: int, position: int) -> Optional[int]:
+    """Index of the lowest set bit at or above position, or None."""
+    bits >>= position
+    if not bits:
+        return None
+    return position + (bits & -bits).bit_length() - 1
+
+
+def _format_minutes(minutes: int) -> str:
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+class CompiledSchedule:
+    """
+    Allowed hours compiled into a minute-of-week bitmap: bit weekday*1440 +
+    minute is set when that minute is open, so a check is one bit test. The
+    default daily window applies to every weekday without its own windows;
+    overnight windows (e.g. 22:00-06:00) belong to the day they start on.
+    Dates covered by exceptions (and the day after, for overnight spill)
+    get their own day bitmaps; a later exception overrides an earlier one
+    on dates they share. Build through compile_schedule() so each
+    distinct configuration is compiled once.
+    """
+    __slots__ = ("start_time", "end_time", "weekday_windows", "date_windows",
+                 "week_bits", "week_ends", "dated", "_arrays")
+
+    def __init__(self, start_time: str, end_time: str,
+                 weekly: Optional[Dict[str, List[Dict[str, str]]]] = None,
+                 exceptions: Optional[List[Dict[str, Any]]] = None):
+        self.start_time = start_time
+        self.end_time = end_time
+        weekly = weekly or {}
+        unknown = set(weekly) - set(WEEKDAYS)
+        if unknown:
+            raise ValueError(f"Unknown weekday(s): {', '.join(sorted(unknown))}")
+
+        default = [_parse_window({"start_time": start_time, "end_time": end_time})]
+        self.weekday_windows: List[List[Window]] = [
+            [_parse_window(w) for w in weekly[name]] if name in weekly else default
+            for name in WEEKDAYS
+        ]
+        self.date_windows: Dict[date, List[Window]] = {}
+        for exception in exceptions or []:
+            first = date.fromisoformat(exception["start_date"])
+            last = date.fromisoformat(exception.get("end_date") or exception["start_date"])
+            windows = [_parse_window(w) for w in exception.get("windows", [])]
+            for offset in range((last - first).days + 1):
+                self.date_windows[first + timedelta(days=offset)] = windows
+
+        parts = [_day_bits(windows) for windows in self.weekday_windows]
+        self.week_bits = self.week_ends = 0
+        for weekday in range(7):
+            own, own_ends, _, _ = parts[weekday]
+            _, _, spill, spill_ends = parts[weekday - 1]  # -1: Sunday spills into Monday
+            self.week_bits |= (own | spill) << (weekday * MINUTES_PER_DAY)
+            self.week_ends |= (own_ends | spill_ends) << (weekday * MINUTES_PER_DAY)
+
+        # Dates whose own or previous day is an exception: (bits, ends) for that day
+        self.dated: Dict[date, Tuple[int, int]] = {}
+        for day in set(self.date_windows) | {d + timedelta(days=1) for d in self.date_windows}:
+            own, own_ends, _, _ = _day_bits(self.windows_on(day))
+            _, _, spill, spill_ends = _day_bits(self.windows_on(day - timedelta(days=1)))
+            self.dated[day] = (own | spill, own_ends | spill_ends)
+        self._arrays = None
+
+    def windows_on(self, day: date) -> List[Window]:
+        """The windows that start on this date."""
+        if day in self.date_windows:
+            return self.date_windows[day]
+        return self.weekday_windows[day.weekday()]
+
+    def hours_text(self, day: date) -> str:
+        """Human-readable windows for a date, e.g. "09:00-12:00, 13:00-18:00" or "Closed"."""
+        windows = self.windows_on(day)
+        if not windows:
+            return "Closed"
+        return ", ".join(f"{_format_minutes(s)}-{_format_minutes(e)}" for s, e in windows)
+
+    def _day_maps(self, day: date) -> Tuple[int, int]:
+        if day in self.dated:
+            return self.dated[day]
+        shift = day.weekday() * MINUTES_PER_DAY
+        return (self.week_bits >> shift) & _DAY_MASK, (self.week_ends >> shift) & _DAY_MASK
+
+    def contains(self, dt: datetime) -> bool:
+        """Whether dt's wall-clock time (in its own timezone) is open."""
+        minute = dt.hour * 60 + dt.minute
+        on_the_minute = dt.second == 0 and dt.microsecond == 0
+        day = dt.date()
+        if day in self.dated:
+            bits, ends = self.dated[day]
+        else:
+            bits, ends = self.week_bits, self.week_ends
+            minute += dt.weekday() * MINUTES_PER_DAY
+        return bool((bits >> minute) & 1 or (on_the_minute and (ends >> minute) & 1))
+
+    def next_opening(self, dt: datetime) -> Optional[datetime]:
+        """
+        First open instant at or after dt (dt itself if open), in dt's
+        timezone, or None if the schedule never opens again within a week
+        after the last exception. Skips whole days with bit scans.
+        """
+        if self.contains(dt):
+            return dt
+        day = dt.date()
+        position = dt.hour * 60 + dt.minute + 1
+        last_day = max([day, *self.date_windows]) + timedelta(days=8)
+        while day <= last_day:
+            bits, ends = self._day_maps(day)
+            minute = _lowest_bit_from(bits | ends, position) if position < MINUTES_PER_DAY else None
+            if minute is not None:
+                naive = datetime.combine(day, time()) + timedelta(minutes=minute)
+                tz = dt.tzinfo
+                if tz is None:
+                    return naive
+                if hasattr(tz, "localize"):  # pytz
+                    return tz.localize(naive)
+                return naive.replace(tzinfo=tz)
+            day += timedelta(days=1)
+            position = 0
+        return None
+
+    def contains_many(self, timestamps) -> np.ndarray:
+        """
+        Vectorized contains() for reporting: timestamps is anything pandas
+        accepts as datetimes (Series, DatetimeIndex, list), evaluated in the
+        wall-clock time they carry. Returns a boolean array.
+        """
+        if self._arrays is None:
+            def unpack(bits: int, length: int) -> np.ndarray:
+                raw = np.frombuffer(bits.to_bytes((length + 7) // 8, "little"), dtype=np.uint8)
+                return np.unpackbits(raw, bitorder="little")[:length].astype(bool)
+            self._arrays = (
+                unpack(self.week_bits, MINUTES_PER_WEEK), unpack(self.week_ends, MINUTES_PER_WEEK),
+                {day: (unpack(b, MINUTES_PER_DAY), unpack(e, MINUTES_PER_DAY)) for day, (b, e) in self.dated.items()},
+            )
+        week_bits, week_ends, dated = self._arrays
+
+        times = pd.DatetimeIndex(timestamps)
+        minutes = (times.hour * 60 + times.minute).to_numpy()
+        on_the_minute = ((times.second == 0) & (times.microsecond == 0) & (times.nanosecond == 0))
+        index = times.weekday.to_numpy() * MINUTES_PER_DAY + minutes
+        mask = week_bits[index] | (on_the_minute & week_ends[index])
+        if dated:
+            days = times.normalize().tz_localize(None)
+            for day, (bits, ends) in dated.items():
+                rows = days == pd.Timestamp(day)
+                if rows.any():
+                    mask[rows] = bits[minutes[rows]] | (on_the_minute[rows] & ends[minutes[rows]])
+        return mask
+
+    def __repr__(self):
+        return f"CompiledSchedule({self.start_time!r}, {self.end_time!r})"
+
+
+@lru_cache(maxsize=1024)
+def _compile_cached(start_time: str, end_time: str, weekly_json: str, exceptions_json: str) -> CompiledSchedule:
+    return CompiledSchedule(
+        start_time, end_time,
+        json.loads(weekly_json) if weekly_json else None,
+        json.loads(exceptions_json) if exceptions_json else None,
+    )
+
+
+def compile_schedule(allowed_hours: Any) -> Optional[CompiledSchedule]:
+    """
+    Compiled (and cached) schedule for allowed_hours, a dict or AllowedHours
+    object. None when no window is configured.
+    """
+    if not allowed_hours:
+        return None
+    if isinstance(allowed_hours, CompiledSchedule):
+        return allowed_hours
+    if not isinstance(allowed_hours, dict):
+        allowed_hours = allowed_hours.to_dict()
+    start_str = allowed_hours.get("start_time")
+    end_str = allowed_hours.get("end_time")
+    if not start_str or not end_str:
+        return None
+    weekly = allowed_hours.get("weekly")
+    exceptions = allowed_hours.get("exceptions")
+    return _compile_cached(
+        start_str, end_str,
+        json.dumps(weekly, sort_keys=True) if weekly else "",
+        json.dumps(exceptions, sort_keys=True) if exceptions else "",
+    )
+
+
+# --- Text form of weekly windows / date exceptions (Admin editor) ---
+# One rule per line; "#" starts a comment:
+#   sat 10:00-14:00             mon-fri 09:00-12:00, 13:00-18:00
+#   sun closed                  2026-12-25 closed
+#   2026-12-24..2026-12-31 10:00-15:00
+
+def _parse_windows_text(text: str) -> List[Dict[str, str]]:
+    if text.strip().lower() == "closed":
+        return []
+    windows = []
+    for part in text.split(","):
+        start, sep, end = part.strip().partition("-")
+        if not sep:
+            raise ValueError(f"Expected HH:MM-HH:MM, got {part.strip()!r}")
+        window = {"start_time": start.strip(), "end_time": end.strip()}
+        _parse_window(window)  # validate
+        windows.append(window)
+    return windows
+
+
+def _parse_weekdays(text: str) -> List[str]:
+    names = []
+    for part in text.lower().split(","):
+        first, _, last = part.partition("-")
+        if first not in WEEKDAYS or (last and last not in WEEKDAYS):
+            raise ValueError(f"Unknown weekday: {part!r} (use {', '.join(WEEKDAYS)})")
+        i, j = WEEKDAYS.index(first), WEEKDAYS.index(last or first)
+        names.extend(WEEKDAYS[k % 7] for k in range(i, j + 1 if j >= i else j + 8))
+    return names
+
+
+def parse_schedule_rules(text: str) -> Tuple[Dict[str, List[Dict[str, str]]], List[Dict[str, Any]]]:
+    """Parse the rule text into (weekly, exceptions) for AllowedHours. Raises ValueError naming the line."""
+    weekly: Dict[str, List[Dict[str, str]]] = {}
+    exceptions: List[Dict[str, Any]] = []
+    for number, line in enumerate(text.splitlines(), start=1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        try:
+            head, _, rest = line.partition(" ")
+            if not rest.strip():
+                raise ValueError("Missing hours (HH:MM-HH:MM or 'closed')")
+            windows = _parse_windows_text(rest)
+            if head[:1].isdigit():
+                first, _, last = head.partition("..")
+                if date.fromisoformat(last or first) < date.fromisoformat(first):
+                    raise ValueError("End date is before start date")
+                exceptions.append({"start_date": first, "end_date": last or first, "windows": windows})
+            else:
+                for name in _parse_weekdays(head):
+                    weekly[name] = windows
+        except (ValueError, KeyError) as e:
+            raise ValueError(f"Line {number}: {e}")
+    return weekly, exceptions
+
+
+def format_schedule_rules(allowed_hours: Dict[str, Any]) -> str:
+    """Inverse of parse_schedule_rules for an allowed-hours dict."""
+    def windows_text(windows):
+        return ", ".join(f"{w['start_time']}-{w['end_time']}" for w in windows) or "closed"
+
+    lines = []
+    weekly = allowed_hours.get("weekly") or {}
+    run: List[str] = []
+    # Consecutive weekdays with identical windows collapse into "mon-fri"
+    for name in WEEKDAYS + (None,):
+        if run and (name is None or name not in weekly or weekly[name] != weekly[run[0]]):
+            days = run[0] if len(run) == 1 else f"{run[0]}-{run[-1]}"
+            lines.append(f"{days} {windows_text(weekly[run[0]])}")
+            run = []
+        if name is not None and name in weekly:
+            run.append(name)
+    for exception in allowed_hours.get("exceptions") or []:
+        dates = exception["start_date"]
+        if exception.get("end_date", dates) != dates:
+            dates += f"..{exception['end_date']}"
+        lines.append(f"{dates} {windows_text(exception.get('windows', []))}")
+    return "\n".join(lines)
+
 
 class TimeValidator:
     @staticmethod
@@ -11,7 +324,7 @@ class TimeValidator:
     def is_within_allowed_hours(current_time: datetime, allowed_hours: Any) -> Tuple[bool, str]:
         """
         Check if current_time is within allowed_hours.
-        allowed_hours can be a dict or AllowedHours object.
+        allowed_hours can be a dict, AllowedHours or CompiledSchedule object.
         Returns (is_allowed, message).
         """
         if not allowed_hours:
@@ -21,30 +334,12 @@ class TimeValidator:
             # PRD for Checkpoint implies allowed_hours is mandatory.
             return True, "Always allowed (No restrictions)"
 
-        # Handle object vs dict
-        if isinstance(allowed_hours, dict):
-            start_str = allowed_hours.get("start_time")
-            end_str = allowed_hours.get("end_time")
-        else:
-            start_str = allowed_hours.start_time
-            end_str = allowed_hours.end_time
-
-        if not start_str or not end_str:
+        schedule = compile_schedule(allowed_hours)
+        if schedule is None:
              return True, "Invalid allowed hours configuration"
 
-        current_t = current_time.time()
-        start_t = TimeValidator.parse_time_string(start_str)
-        end_t = TimeValidator.parse_time_string(end_str)
-
-        # Handle overnight case (e.g. 22:00 to 06:00)
-        if start_t > end_t:
-            if current_t >= start_t or current_t <= end_t:
-                return True, "Within allowed hours"
-        else:
-            # Standard case (e.g. 09:00 to 18:00)
-            if start_t <= current_t <= end_t:
-                return True, "Within allowed hours"
-        
+        if schedule.contains(current_time):
+            return True, "Within allowed hours"
         return False, "Outside of allowed hours"
 
     @staticmethod
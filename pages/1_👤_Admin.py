@@ -1,15 +1,20 @@
 import streamlit as st
 import pandas as pd
+import os
 import secrets
+import tempfile
 from datetime import datetime, time, timedelta, date
 import pytz
 import time as time_module
 from core.models import Checkpoint, Guest, AllowedHours, AdminSettings
-from core.storage import JSONStorage
+from core.storage import get_storage, get_log_writer
 from core.auth import AuthManager
 from core.time_service import TimeService
+from core.time_validator import compile_schedule, parse_schedule_rules, format_schedule_rules
+from core.qr_export import export_qr_sheets
+from core.qr_decoder import get_decode_service
 from utils.helpers import (
-    get_checkpoint_name, get_guest_name, get_guest_email,
+    get_checkpoint_names, get_checkpoint_labels, get_guest_labels, add_name_columns,
     is_valid_email, checkpoint_name_exists, guest_email_exists
 )
 from config.default_credentials import (
@@ -18,7 +23,14 @@ from config.default_credentials import (
 )
 
 # Initialize storage
-storage = JSONStorage()
+storage = get_storage()
+
+# Help text for the weekly hours / exceptions editor (checkpoint forms)
+SCHEDULE_RULES_HELP = (
+    "Optional, one rule per line. Weekdays override the daily hours above; dates override weekdays. "
+    "Examples: `sat 10:00-14:00`, `mon-fri 09:00-12:00, 13:00-18:00`, `sun closed`, "
+    "`2026-12-25 closed`, `2026-12-24..2026-12-31 10:00-15:00`"
+)
 
 # Page Config
 st.set_page_config(page_title="Admin - QR In/Out", page_icon="👤", layout="wide")
@@ -327,7 +339,7 @@ else:
     if menu == "Checkpoint Management":
         st.header("🏢 Checkpoint Management")
         
-        tab1, tab2, tab3 = st.tabs(["📝 Create New Checkpoint", "✏️ Edit Checkpoint", "⚠️ Danger Zone"])
+        tab1, tab2, tab3, tab4 = st.tabs(["📝 Create New Checkpoint", "✏️ Edit Checkpoint", "⚠️ Danger Zone", "🖨️ Print QR Sheets"])
         
         with tab1:
             st.subheader("Create New Checkpoint")
@@ -340,6 +352,7 @@ else:
                     start_time = st.time_input("Allowed Start Time", value=time(9, 0))
                 with col2:
                     end_time = st.time_input("Allowed End Time", value=time(18, 0))
+                schedule_rules = st.text_area("Weekly Hours & Exceptions", height=100, help=SCHEDULE_RULES_HELP)
 
                 qr_mode = st.radio(
                     "QR Code Mode",
@@ -355,10 +368,11 @@ else:
                     password_confirm = st.text_input("Confirm Host Password *", type="password")
 
                 guests = storage.get_active_guests()
+                guest_labels = get_guest_labels()
                 allowed_guests = st.multiselect(
                     "Allowed Guests (Multiselect)",
                     options=[g["id"] for g in guests],
-                    format_func=lambda x: f"{get_guest_name(x)} ({get_guest_email(x)})",
+                    format_func=lambda x: guest_labels.get(x, "Unknown Guest"),
                     help="If 0 are selected, all guests will be blocked"
                 )
 
@@ -376,6 +390,11 @@ else:
                     elif admin_password != password_confirm:
                         errors.append("Passwords do not match")
 
+                    try:
+                        weekly, exceptions = parse_schedule_rules(schedule_rules)
+                    except ValueError as e:
+                        errors.append(f"Weekly hours: {e}")
+
                     if errors:
                         for error in errors:
                             st.error(f"❌ {error}")
@@ -385,7 +404,9 @@ else:
                             location=location,
                             allowed_hours=AllowedHours(
                                 start_time=start_time.strftime("%H:%M"),
-                                end_time=end_time.strftime("%H:%M")
+                                end_time=end_time.strftime("%H:%M"),
+                                weekly=weekly,
+                                exceptions=exceptions
                             ),
                             qr_mode=qr_mode,
                             admin_password_hash=AuthManager.hash_password(admin_password),
@@ -404,10 +425,12 @@ else:
             if not checkpoints:
                 st.info("No checkpoints registered.")
             else:
+                cp_names = get_checkpoint_names()
+                guest_labels = get_guest_labels()
                 selected_id = st.selectbox(
                     "Select Checkpoint to Edit",
                     options=[c["id"] for c in checkpoints],
-                    format_func=get_checkpoint_name,
+                    format_func=lambda x: cp_names.get(x, "Unknown Checkpoint"),
                     key="edit_cp_select"
                 )
                 
@@ -422,6 +445,8 @@ else:
                             e_start = st.time_input("Allowed Start Time", value=datetime.strptime(cp_data["allowed_hours"]["start_time"], "%H:%M").time())
                         with c2:
                             e_end = st.time_input("Allowed End Time", value=datetime.strptime(cp_data["allowed_hours"]["end_time"], "%H:%M").time())
+                        e_schedule_rules = st.text_area("Weekly Hours & Exceptions", value=format_schedule_rules(cp_data["allowed_hours"]),
+                                                        height=100, help=SCHEDULE_RULES_HELP)
                         
                         e_qr_mode = st.radio(
                             "QR Code Mode",
@@ -434,7 +459,7 @@ else:
                             "Allowed Guests",
                             options=[g["id"] for g in storage.get_active_guests()],
                             default=cp_data["allowed_guests"],
-                            format_func=lambda x: f"{get_guest_name(x)} ({get_guest_email(x)})"
+                            format_func=lambda x: guest_labels.get(x, "Unknown Guest")
                         )
                         
                         st.info("Enter a new password to change HOST password. Leave blank to keep current.")
@@ -451,6 +476,11 @@ else:
                             
                             if e_password and len(e_password) < 4:
                                 errors.append("Password must be at least 4 characters")
+
+                            try:
+                                e_weekly, e_exceptions = parse_schedule_rules(e_schedule_rules)
+                            except ValueError as e:
+                                errors.append(f"Weekly hours: {e}")
                                 
                             if errors:
                                 for error in errors:
@@ -461,7 +491,9 @@ else:
                                     "location": e_location,
                                     "allowed_hours": {
                                         "start_time": e_start.strftime("%H:%M"),
-                                        "end_time": e_end.strftime("%H:%M")
+                                        "end_time": e_end.strftime("%H:%M"),
+                                        "weekly": e_weekly,
+                                        "exceptions": e_exceptions
                                     },
                                     "qr_mode": e_qr_mode,
                                     "allowed_guests": e_guests
@@ -480,7 +512,8 @@ else:
             if not checkpoints:
                 st.info("No checkpoints registered.")
             else:
-                del_id = st.selectbox("Select Checkpoint to Delete", [c["id"] for c in checkpoints], format_func=get_checkpoint_name, key="del_cp_select")
+                cp_names = get_checkpoint_names()
+                del_id = st.selectbox("Select Checkpoint to Delete", [c["id"] for c in checkpoints], format_func=lambda x: cp_names.get(x, "Unknown Checkpoint"), key="del_cp_select")
                 st.warning("⚠️ Warning: Deleting a checkpoint will make it unusable. Historical records are preserved.")
                 
                 if st.button("Delete Checkpoint", type="secondary"):
@@ -494,6 +527,64 @@ else:
                         st.session_state.confirm_del_cp_id = del_id
                         st.error("⚠️ Click again to confirm deletion.")
 
+        with tab4:
+            st.subheader("Print QR Sheets")
+            static_cps = [c for c in storage.get_active_checkpoints() if c["qr_mode"] == "static"]
+            if not static_cps:
+                st.info("No static checkpoints registered.")
+            else:
+                cp_labels = get_checkpoint_labels()
+                with st.form("export_qr_sheets"):
+                    export_ids = st.multiselect(
+                        "Static Checkpoints",
+                        options=[c["id"] for c in static_cps],
+                        default=[c["id"] for c in static_cps],
+                        format_func=lambda x: cp_labels.get(x, "Unknown Checkpoint")
+                    )
+                    export_format = st.radio(
+                        "Output",
+                        options=["pdf", "zip"],
+                        format_func=lambda x: "PDF (A4 sheets)" if x == "pdf" else "ZIP (one PNG per checkpoint)",
+                        horizontal=True
+                    )
+                    c1, c2 = st.columns(2)
+                    with c1:
+                        grid_columns = st.number_input("Columns per Page (PDF)", min_value=1, max_value=6, value=2)
+                    with c2:
+                        grid_rows = st.number_input("Rows per Page (PDF)", min_value=1, max_value=8, value=3)
+
+                    if st.form_submit_button("Generate", type="primary"):
+                        if not export_ids:
+                            st.error("❌ Select at least one checkpoint")
+                        else:
+                            # Rendered in parallel processes and written straight to a temp file
+                            previous = st.session_state.get("qr_export")
+                            if previous and os.path.exists(previous[0]):
+                                os.remove(previous[0])
+                            fd, export_path = tempfile.mkstemp(suffix=f".{export_format}")
+                            os.close(fd)
+                            progress_bar = st.progress(0.0)
+                            selected = [c for c in static_cps if c["id"] in export_ids]
+                            export_qr_sheets(
+                                selected, export_path, export_format=export_format,
+                                payload_format=settings.get("qr_payload_format", "json"),
+                                grid=(grid_columns, grid_rows),
+                                progress=lambda done, total: progress_bar.progress(done / total)
+                            )
+                            st.session_state.qr_export = (export_path, export_format)
+                            st.success(f"✅ {len(selected)} QR code(s) generated.")
+
+                qr_export = st.session_state.get("qr_export")
+                if qr_export and os.path.exists(qr_export[0]):
+                    export_path, export_format = qr_export
+                    with open(export_path, "rb") as f:
+                        st.download_button(
+                            label="🖨️ Download QR Sheets",
+                            data=f,
+                            file_name=f"qr_sheets_{date.today()}.{export_format}",
+                            mime="application/pdf" if export_format == "pdf" else "application/zip"
+                        )
+
     elif menu == "Guest Management":
         st.header("👤 Guest Management")
         
@@ -525,10 +616,11 @@ else:
                         g_end = st.time_input("Allowed End Time", value=time(20, 0))
                     g_allowed_hours = AllowedHours(start_time=g_start.strftime("%H:%M"), end_time=g_end.strftime("%H:%M"))
                     
+                cp_names = get_checkpoint_names()
                 g_checkpoints = st.multiselect(
                     "Allowed Checkpoints (Multiselect)",
                     options=[c["id"] for c in storage.get_active_checkpoints()],
-                    format_func=lambda x: get_checkpoint_name(x)
+                    format_func=lambda x: cp_names.get(x, "Unknown Checkpoint")
                 )
                 
                 g_submitted = st.form_submit_button("Register", type="primary")
@@ -565,7 +657,9 @@ else:
             if not guests:
                 st.info("No guests registered.")
             else:
-                selected_g_id = st.selectbox("Select Guest to Edit", [g["id"] for g in guests], format_func=lambda x: f"{get_guest_name(x)} ({get_guest_email(x)})")
+                guest_labels = get_guest_labels()
+                cp_names = get_checkpoint_names()
+                selected_g_id = st.selectbox("Select Guest to Edit", [g["id"] for g in guests], format_func=lambda x: guest_labels.get(x, "Unknown Guest"))
                 if selected_g_id:
                     g_data = storage.get_by_id("guests", selected_g_id)
                     with st.form("edit_guest"):
@@ -578,7 +672,7 @@ else:
                             "Allowed Checkpoints",
                             options=[c["id"] for c in storage.get_active_checkpoints()],
                             default=g_data["allowed_checkpoints"],
-                            format_func=lambda x: get_checkpoint_name(x)
+                            format_func=lambda x: cp_names.get(x, "Unknown Checkpoint")
                         )
                         
                         eg_submitted = st.form_submit_button("Update", type="primary")
@@ -610,7 +704,8 @@ else:
             if not guests:
                 st.info("No guests registered.")
             else:
-                del_g_id = st.selectbox("Select Guest to Delete", [g["id"] for g in guests], format_func=lambda x: f"{get_guest_name(x)} ({get_guest_email(x)})", key="del_guest_select")
+                guest_labels = get_guest_labels()
+                del_g_id = st.selectbox("Select Guest to Delete", [g["id"] for g in guests], format_func=lambda x: guest_labels.get(x, "Unknown Guest"), key="del_guest_select")
                 st.warning("⚠️ Warning: Deleting a guest will prevent them from checking in. Historical records are preserved.")
                 if st.button("Delete Guest", type="secondary"):
                     if st.session_state.get("confirm_del_g_id") == del_g_id:
@@ -628,23 +723,20 @@ else:
         
         view_mode = st.radio("View Mode", ["All", "By Checkpoint", "By Guest"], horizontal=True)
         
-        logs = storage.load("activity_logs")
+        col1, col2 = st.columns(2)
+        with col1:
+            start_date = st.date_input("Start Date", value=date.today() - timedelta(days=7))
+        with col2:
+            end_date = st.date_input("End Date", value=date.today())
+
+        # Filter by date in the storage layer
+        logs = storage.load_activity_logs(start_date=start_date, end_date=end_date)
         if not logs:
             st.info("No activity records found.")
         else:
             df = pd.DataFrame(logs)
             df["timestamp"] = pd.to_datetime(df["timestamp"])
-            df["checkpoint_name"] = df["checkpoint_id"].apply(get_checkpoint_name)
-            df["guest_name"] = df["guest_id"].apply(get_guest_name)
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                start_date = st.date_input("Start Date", value=date.today() - timedelta(days=7))
-            with col2:
-                end_date = st.date_input("End Date", value=date.today())
-                
-            # Filter by date
-            df = df[(df["timestamp"].dt.date >= start_date) & (df["timestamp"].dt.date <= end_date)]
+            df = add_name_columns(df)
             
             if view_mode == "By Checkpoint":
                 cp_filter = st.selectbox("Select Checkpoint", ["All"] + [c["name"] for c in storage.load("checkpoints")])
@@ -667,7 +759,15 @@ else:
 
     elif menu == "Statistics Dashboard":
         st.header("📈 Statistics Dashboard")
-        logs = storage.load("activity_logs")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            stats_start = st.date_input("Start Date", value=date.today() - timedelta(days=30), key="stats_start")
+        with col2:
+            stats_end = st.date_input("End Date", value=date.today(), key="stats_end")
+
+        # Filter by date in the storage layer (indexed query on SQLite)
+        logs = storage.load_activity_logs(start_date=stats_start, end_date=stats_end)
         if not logs:
             st.info("Not enough data to display statistics.")
         else:
@@ -687,10 +787,30 @@ else:
             st.line_chart(hour_counts.set_index("hour"))
             
             st.subheader("Activities by Checkpoint")
-            df["checkpoint_name"] = df["checkpoint_id"].apply(get_checkpoint_name)
+            df["checkpoint_name"] = df["checkpoint_id"].map(get_checkpoint_names()).fillna("Unknown Checkpoint")
             cp_counts = df.groupby("checkpoint_name").size().reset_index(name="counts")
             st.bar_chart(cp_counts.set_index("checkpoint_name"))
 
+            st.subheader("Outside Checkpoint Hours")
+            # Each scan is checked the way it was validated: against its
+            # checkpoint's window, in the wall-clock time of the guest's timezone
+            guest_tz = {g["id"]: g.get("timezone") or settings["default_guest_timezone"] for g in storage.load("guests")}
+            df["guest_timezone"] = df["guest_id"].map(guest_tz).fillna(settings["default_guest_timezone"])
+            df["outside_hours"] = False
+            for cp in storage.load("checkpoints"):
+                schedule = compile_schedule(cp.get("allowed_hours"))
+                cp_rows = df["checkpoint_id"] == cp["id"]
+                if schedule is None or not cp_rows.any():
+                    continue
+                for tz, group in df[cp_rows].groupby("guest_timezone"):
+                    df.loc[group.index, "outside_hours"] = ~schedule.contains_many(group["timestamp"].dt.tz_convert(tz))
+            outside = df[df["outside_hours"]]
+            if outside.empty:
+                st.caption("All activities fall within their checkpoint's allowed hours.")
+            else:
+                st.caption(f"{len(outside)} activit{'y' if len(outside) == 1 else 'ies'} recorded outside allowed hours (in each guest's timezone).")
+                st.bar_chart(outside.groupby("checkpoint_name").size().rename("counts"))
+
     elif menu == "System Settings":
         st.header("⚙️ System Settings")
         
@@ -698,12 +818,22 @@ else:
             new_admin_tz = st.selectbox("Admin Timezone", pytz.all_timezones, index=pytz.all_timezones.index(settings["admin_timezone"]))
             new_default_guest_tz = st.selectbox("Default Guest Timezone", pytz.all_timezones, index=pytz.all_timezones.index(settings["default_guest_timezone"]))
             new_qr_interval = st.number_input("QR Refresh Interval (seconds)", min_value=60, max_value=7200, value=settings["qr_refresh_interval"])
+            qr_seq_modes = {"counter": "Counter (stored per checkpoint)", "time_bucket": "Time bucket (derived from clock)"}
+            new_dynamic_qr_mode = st.selectbox("Dynamic QR Sequence", options=list(qr_seq_modes),
+                                               index=list(qr_seq_modes).index(settings.get("dynamic_qr_mode", "counter")),
+                                               format_func=lambda x: qr_seq_modes[x])
+            qr_formats = {"json": "JSON (v1.0)", "compact": "Compact (v2.0, smaller QR)"}
+            new_qr_payload_format = st.selectbox("QR Payload Format", options=list(qr_formats),
+                                                 index=list(qr_formats).index(settings.get("qr_payload_format", "json")),
+                                                 format_func=lambda x: qr_formats[x])
             new_require_sync = st.checkbox("Require Time Sync (Block if API fails)", value=settings["require_time_sync"])
             
             if st.form_submit_button("Save Settings"):
                 settings["admin_timezone"] = new_admin_tz
                 settings["default_guest_timezone"] = new_default_guest_tz
                 settings["qr_refresh_interval"] = new_qr_interval
+                settings["dynamic_qr_mode"] = new_dynamic_qr_mode
+                settings["qr_payload_format"] = new_qr_payload_format
                 settings["require_time_sync"] = new_require_sync
                 storage.save_admin_settings(settings)
                 st.success("✅ System settings saved!")
@@ -714,3 +844,23 @@ else:
         st.divider()
         curr_time, is_synced = TimeService.get_current_time(settings["admin_timezone"])
         TimeService.show_time_sync_status(is_synced, curr_time)
+
+        # Scan decoder load (this server process)
+        st.subheader("Scan Decoder")
+        decoder = get_decode_service().metrics()
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Queue / Running", f"{decoder['queue_depth']} / {decoder['running']}", help=f"Capacity: {decoder['capacity']}")
+        m2.metric("Avg / p95 Decode", f"{decoder['avg_decode_ms']:.0f} / {decoder['p95_decode_ms']:.0f} ms")
+        m3.metric("Avg Queue Wait", f"{decoder['avg_wait_ms']:.0f} ms")
+        m4.metric("Completed", decoder["completed"])
+        st.caption(f"Cache hits: {decoder['cache_hits']} · Failed: {decoder['failed']} · Rejected (busy): {decoder['rejected']} · Timed out: {decoder['timed_out']}")
+
+        # Activity log writer (this server process)
+        st.subheader("Activity Log Writer")
+        writer = get_log_writer().stats()
+        w1, w2, w3, w4 = st.columns(4)
+        w1.metric("Written", writer["written"])
+        w2.metric("Queued", writer["queued"])
+        w3.metric("Spilled (pending replay)", writer["spill_pending"])
+        w4.metric("Lost", writer["lost"])
+        st.caption(f"Retries: {writer['retries']} · Spilled: {writer['spilled']} · Replayed: {writer['replayed']}")
@@ -1,18 +1,17 @@
+import json
 import streamlit as st
 import time as time_module
 from datetime import datetime, timedelta
 import pytz
-import io
 
-from core.storage import JSONStorage
+from core.storage import get_storage
 from core.qr_manager import QRManager
 from core.time_service import TimeService
 from core.auth import AuthManager
-from core.time_validator import TimeValidator
-from utils.helpers import get_checkpoint_name, get_checkpoint_location
+from core.time_validator import TimeValidator, compile_schedule
 
 # Initialize storage
-storage = JSONStorage()
+storage = get_storage()
 
 # Page Config
 st.set_page_config(page_title="Host - QR In/Out", page_icon="🖥️", layout="wide")
@@ -60,11 +59,191 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
+# Seconds before expiry at which the next dynamic QR is prepared in the background
+QR_PRERENDER_LEAD_SECONDS = 10
+
+# --- Dynamic QR payloads ---
+# The displayed code lives in st.session_state.dynamic_qr; its successor is
+# prepared ahead of time in st.session_state.dynamic_qr_next.
+
+def dynamic_settings_key(settings) -> tuple:
+    """Settings a displayed dynamic QR was built with: (sequence mode, refresh interval, payload format)."""
+    return (settings.get("dynamic_qr_mode", "counter"), settings["qr_refresh_interval"],
+            settings.get("qr_payload_format", "json"))
+
+def build_dynamic_qr(checkpoint_id: str, sequence: int, issued_at: datetime, settings_key: tuple) -> dict:
+    _, refresh_interval, payload_format = settings_key
+    expires_at = issued_at + timedelta(seconds=refresh_interval)
+    return {
+        "checkpoint_id": checkpoint_id,
+        "sequence": sequence,
+        "issued_at": issued_at,
+        "expires_at": expires_at,
+        "settings_key": settings_key,
+        "content": QRManager.generate_dynamic_qr_content(
+            checkpoint_id, sequence, issued_at, expires_at, refresh_interval, payload_format
+        ),
+    }
+
+def next_dynamic_qr(current: dict, issued_at: datetime) -> dict:
+    """The code following `current`, issued at `issued_at` (its expiry when prepared ahead of time)."""
+    mode, refresh_interval, _ = current["settings_key"]
+    if mode == "time_bucket":
+        sequence, issued_at, _ = QRManager.get_time_bucket(issued_at, refresh_interval)
+    else:
+        sequence = current["sequence"] + 1
+    return build_dynamic_qr(current["checkpoint_id"], sequence, issued_at, current["settings_key"])
+
+def activate_dynamic_qr(qr: dict):
+    """
+    Make qr the displayed code. Counter mode records its sequence, invalidating
+    older codes; the stored sequence only ever advances, so if another display
+    of this checkpoint is already ahead we continue from its sequence instead.
+    """
+    if qr["settings_key"][0] == "counter":
+        stored = storage.advance_qr_sequence(qr["checkpoint_id"], qr["sequence"])
+        if stored > qr["sequence"]:
+            qr = build_dynamic_qr(qr["checkpoint_id"], stored, qr["issued_at"], qr["settings_key"])
+    st.session_state.dynamic_qr = qr
+    st.session_state.dynamic_qr_next = None
+
+def host_config_key(checkpoint: dict, settings: dict) -> str:
+    """Everything the full page run renders from: a change means the fragments must rerun the app."""
+    return json.dumps([
+        checkpoint.get("qr_mode"), checkpoint.get("allowed_hours"), checkpoint.get("deleted_at"),
+        settings["admin_timezone"], list(dynamic_settings_key(settings)),
+    ], sort_keys=True, default=str)
+
+def rerun_if_config_changed(checkpoint_id: str):
+    """
+    Reload the checkpoint and admin settings (cheap: cached until the files
+    change) and rerun the app if an Admin edit touched what the page shows,
+    so the fragments never keep running on the configuration they captured.
+    """
+    checkpoint = storage.get_by_id("checkpoints", checkpoint_id)
+    if checkpoint is None or \
+       host_config_key(checkpoint, storage.load_admin_settings()) != st.session_state.get("host_config_key"):
+        st.rerun(scope="app")
+
+# --- Session token ---
+# Kept in the page URL so a kiosk display can resume after a reconnect or
+# reload without the password. Tokens are short-lived, single-use and bound
+# to this display's browser, and are rotated well before they expire.
+
+def display_binding() -> str:
+    """What session tokens are bound to: the display browser's User-Agent."""
+    return st.context.headers.get("User-Agent", "")
+
+def set_session_token(checkpoint: dict):
+    """Issue a fresh token into the URL, revoking the one it replaces."""
+    old_token = st.query_params.get("session")
+    token = AuthManager.issue_session_token(f"host:{checkpoint['id']}", checkpoint["admin_password_hash"],
+                                            binding=display_binding())
+    if token is None:
+        return  # No QR_SECRET_KEY: no resumable sessions
+    st.query_params["session"] = token
+    st.session_state.session_token_renew_at = time_module.time() + AuthManager.session_ttl() / 2
+    if old_token and old_token != token:
+        AuthManager.revoke_session_token(old_token, binding=display_binding())
+
+def renew_session_token(checkpoint_id: str):
+    """Rotate the URL token once half its lifetime has passed."""
+    if time_module.time() < st.session_state.get("session_token_renew_at", 0):
+        return
+    checkpoint = storage.get_by_id("checkpoints", checkpoint_id)
+    if checkpoint is not None:
+        set_session_token(checkpoint)
+
+# --- Fragments ---
+# Only these re-run every second; the rest of the page (storage reads, time
+# sync, the QR image) runs once per status or settings change or QR rotation.
+
+@st.fragment(run_every=1)
+def host_clock(checkpoint_id: str, timezone_str: str, schedule, was_allowed: bool):
+    """Tick the host clock and trigger a full rerun when the allowed-hours status or the configuration changes."""
+    rerun_if_config_changed(checkpoint_id)
+    renew_session_token(checkpoint_id)
+    now, _ = TimeService.get_current_time(timezone_str)
+    st.write(f"⏰ {now.strftime('%Y-%m-%d %H:%M:%S')}")
+    is_allowed_now, _ = TimeValidator.is_within_allowed_hours(now, schedule)
+    if is_allowed_now != was_allowed:
+        st.rerun(scope="app")
+
+def rotate_dynamic_qr(now: datetime) -> bool:
+    """
+    Swap in the next code once the displayed one has expired (the prepared
+    one if the look-ahead ran). Returns True if the code changed.
+    """
+    current = st.session_state.dynamic_qr
+    if now < current["expires_at"]:
+        return False
+    prepared = st.session_state.get("dynamic_qr_next")
+    if prepared is None or prepared["expires_at"] <= now:
+        # Missed the look-ahead (e.g. page was off-hours): issue from now
+        prepared = next_dynamic_qr(current, now)
+    activate_dynamic_qr(prepared)
+    return True
+
+def dynamic_qr_image():
+    """
+    The displayed code, emitted by the full run only. SVG images travel
+    inline as data URIs, so keeping this out of the per-second fragment
+    means each code is sent to the browser once, at rotation.
+    """
+    now, _ = TimeService.get_utc_now()
+    rotate_dynamic_qr(now)
+    # Vector image scaled by the browser; cached, so a rotation finds it pre-rendered
+    st.image(QRManager.generate_qr_svg(st.session_state.dynamic_qr["content"]), width=400)
+
+@st.fragment(run_every=1)
+def dynamic_qr_countdown():
+    """
+    Tick the countdown under the dynamic QR. Shortly before expiry the next
+    code is built and its image rendered in the background; at expiry the
+    app reruns once so dynamic_qr_image() shows it.
+    """
+    # Same synchronized clock guests are validated against (never blocks)
+    now, _ = TimeService.get_utc_now()
+    current = st.session_state.dynamic_qr
+    # Mode, interval or hours changed in Admin: the full run rebuilds the code
+    rerun_if_config_changed(current["checkpoint_id"])
+
+    if rotate_dynamic_qr(now):
+        st.rerun(scope="app")
+    if st.session_state.get("dynamic_qr_next") is None and \
+       (current["expires_at"] - now).total_seconds() <= QR_PRERENDER_LEAD_SECONDS:
+        st.session_state.dynamic_qr_next = next_dynamic_qr(current, current["expires_at"])
+        QRManager.prerender_qr_svg(st.session_state.dynamic_qr_next["content"])
+
+    refresh_interval = current["settings_key"][1]
+    time_until_refresh = (current["expires_at"] - now).total_seconds()
+    countdown_str = TimeValidator.format_countdown(time_until_refresh)
+    st.markdown(f'<div class="countdown">⏱️ Auto-refresh in: {countdown_str}</div>', unsafe_allow_html=True)
+    st.markdown(f'<div class="sequence-no">Sequence: #{current["sequence"]}</div>', unsafe_allow_html=True)
+
+    # Progress bar (Full -> Empty)
+    progress = max(0.0, min(1.0, time_until_refresh / refresh_interval))
+    st.progress(progress)
+
 # Session state initialization
 if "host_authenticated" not in st.session_state:
     st.session_state.host_authenticated = False
     st.session_state.selected_checkpoint_id = None
 
+# Resume from the session token in the URL (kiosk reconnect / reload) without
+# bcrypt. Consuming it makes it single-use; the display gets a fresh one.
+if not st.session_state.host_authenticated and "session" in st.query_params:
+    claims = AuthManager.consume_session_token(st.query_params["session"], binding=display_binding())
+    subject = claims["sub"] if claims else ""
+    resumed = storage.get_by_id("checkpoints", subject[len("host:"):]) if subject.startswith("host:") else None
+    if resumed and not resumed.get("deleted_at") and \
+       claims["fp"] == AuthManager.password_fingerprint(resumed["admin_password_hash"]):
+        st.session_state.host_authenticated = True
+        st.session_state.selected_checkpoint_id = resumed["id"]
+        set_session_token(resumed)
+    else:
+        del st.query_params["session"]
+
 # --- UI: Unauthenticated State ---
 if not st.session_state.host_authenticated:
     st.title("🖥️ Host Page")
@@ -76,10 +255,11 @@ if not st.session_state.host_authenticated:
         st.error("No active checkpoints found. Please create one in Admin page.")
     else:
         with st.form("host_login"):
+            cp_labels = {c["id"]: f"{c['name']} ({c['location']})" for c in checkpoints}
             selected_id = st.selectbox(
                 "Select Checkpoint",
                 options=[c["id"] for c in checkpoints],
-                format_func=lambda x: f"{get_checkpoint_name(x)} ({get_checkpoint_location(x)})"
+                format_func=lambda x: cp_labels[x]
             )
             password = st.text_input("Admin Password", type="password")
             
@@ -90,6 +270,7 @@ if not st.session_state.host_authenticated:
                 if AuthManager.verify_password(password, checkpoint["admin_password_hash"]):
                     st.session_state.host_authenticated = True
                     st.session_state.selected_checkpoint_id = selected_id
+                    set_session_token(checkpoint)
                     st.success("✅ Authenticated!")
                     time_module.sleep(1)
                     st.rerun()
@@ -100,6 +281,7 @@ if not st.session_state.host_authenticated:
 else:
     checkpoint = storage.get_by_id("checkpoints", st.session_state.selected_checkpoint_id)
     settings = storage.load_admin_settings()
+    st.session_state.host_config_key = host_config_key(checkpoint, settings)
     
     # 1. Header & Lock
     col1, col2 = st.columns([6, 1])
@@ -111,21 +293,23 @@ else:
         if st.button("🔒 Lock"):
             st.session_state.host_authenticated = False
             st.session_state.selected_checkpoint_id = None
+            if "session" in st.query_params:
+                AuthManager.revoke_session_token(st.query_params["session"], binding=display_binding())
+                del st.query_params["session"]
             st.rerun()
             
     st.divider()
     
     # 2. Time Synchronization Logic (Correction)
-    # Use TimeService just to check sync status securely
-    synced_time, is_synced = TimeService.get_current_time(settings["admin_timezone"])
+    # Everything on this page uses the TimeService clock, the same one guest
+    # scans are validated against, so hours, time buckets and expiries agree.
+    # It is answered locally from the last measured offset and never blocks.
+    current_time_display, is_synced = TimeService.get_current_time(settings["admin_timezone"])
+    current_time_utc = current_time_display.astimezone(pytz.UTC)
     
-    # Use system time for visual countdown to avoid cache lag
-    # We trust local server time + simple offset if needed, but for now assuming server time is relevant
-    current_time_display = datetime.now(pytz.timezone(settings["admin_timezone"]))
-    current_time_utc = datetime.now(pytz.UTC)
-    
-    # 3. Check Allowed Hours
-    is_allowed, msg = TimeValidator.is_within_allowed_hours(current_time_display, checkpoint["allowed_hours"])
+    # 3. Check Allowed Hours (compiled once; host_clock re-checks every second)
+    schedule = compile_schedule(checkpoint["allowed_hours"])
+    is_allowed, msg = TimeValidator.is_within_allowed_hours(current_time_display, schedule)
     
     with st.container():
         col_status, col_time = st.columns([1, 1])
@@ -138,45 +322,49 @@ else:
                 
         with col_time:
             st.write(f"**Host Time** ({settings['admin_timezone']})")
-            st.write(f"⏰ {current_time_display.strftime('%Y-%m-%d %H:%M:%S')}")
+            host_clock(checkpoint["id"], settings["admin_timezone"], schedule, is_allowed)
             
     st.divider()
     
     # Show precise sync status below divider or in a simplified way
-    # TimeService.show_time_sync_status(is_synced, synced_time) 
+    # TimeService.show_time_sync_status(is_synced, current_time_display) 
     # Moving this to bottom or making it less intrusive if causing layout issues?
     # Let's keep it but ensure it doesn't overlap.
 
     # 4. Display Content
     if not is_allowed:
-        st.warning(f"Regular Hours: {checkpoint['allowed_hours']['start_time']} - {checkpoint['allowed_hours']['end_time']}")
+        st.warning(f"Regular Hours Today: {schedule.hours_text(current_time_display.date())}")
+        opens_at = schedule.next_opening(current_time_display)
+        if opens_at:
+            st.caption(f"Opens {opens_at.strftime('%a %Y-%m-%d %H:%M')}")
         st.info("QR Code is hidden during off-hours.")
-        
-        # Auto-refresh to check time status occasionally
-        time_module.sleep(5) 
-        st.rerun()
+        # host_clock reruns the page once the checkpoint opens
         
     else:
         # ALLOWED: Show QR
         
         # Determine QR Mode
         qr_mode = checkpoint["qr_mode"]
+        payload_format = settings.get("qr_payload_format", "json")
         
         if qr_mode == "static":
-            # Static QR
-            qr_content = QRManager.generate_static_qr_content(checkpoint["id"])
-            qr_img = QRManager.generate_qr_image(qr_content, box_size=15)
+            # Static QR (content kept per session so the rendered image stays cached)
+            static_key = (checkpoint["id"], payload_format)
+            if st.session_state.get("static_qr_key") != static_key:
+                st.session_state.static_qr_key = static_key
+                st.session_state.static_qr_content = QRManager.generate_static_qr_content(
+                    checkpoint["id"], payload_format=payload_format
+                )
+            qr_content = st.session_state.static_qr_content
             
-            # Convert to bytes for display/download
-            img_bytes = io.BytesIO()
-            qr_img.save(img_bytes, format='PNG')
-            img_bytes = img_bytes.getvalue()
+            # SVG for display; the PNG is only rendered for the print download (both cached by content)
+            img_bytes = QRManager.generate_qr_bytes(qr_content, box_size=15)
             
             # Display
             col1, col2, col3 = st.columns([1, 2, 1])
             with col2:
                 st.markdown('<div class="qr-container">', unsafe_allow_html=True)
-                st.image(img_bytes, width=400)
+                st.image(QRManager.generate_qr_svg(qr_content), width=400)
                 st.markdown('</div>', unsafe_allow_html=True)
                 st.info("ℹ️ Static Mode: Valid as long as hours allow.")
             
@@ -190,62 +378,24 @@ else:
             
         else:
             # Dynamic QR
-            refresh_interval = settings["qr_refresh_interval"]
-            
-            # Init Session State for Refreshes if missing
-            if "last_refresh_time" not in st.session_state:
-                st.session_state.last_refresh_time = current_time_utc
-                st.session_state.next_refresh_time = current_time_utc + timedelta(seconds=refresh_interval)
-                
-                # Increment sequence
-                checkpoint["current_qr_sequence"] += 1
-                storage.update("checkpoints", checkpoint["id"], {"current_qr_sequence": checkpoint["current_qr_sequence"]})
-
-            # Check if expired
-            time_until_refresh = (st.session_state.next_refresh_time - current_time_utc).total_seconds()
-            
-            if time_until_refresh <= 0:
-                # Refresh Triggered!
-                st.session_state.last_refresh_time = current_time_utc
-                st.session_state.next_refresh_time = current_time_utc + timedelta(seconds=refresh_interval)
-                
-                checkpoint["current_qr_sequence"] += 1
-                storage.update("checkpoints", checkpoint["id"], {"current_qr_sequence": checkpoint["current_qr_sequence"]})
-                st.rerun()
-            
-            # Generate QR Content (using stable session state times to prevent flicker)
-            qr_raw_content = QRManager.generate_dynamic_qr_content(
-                checkpoint_id=checkpoint["id"],
-                current_sequence=checkpoint["current_qr_sequence"],
-                issued_at=st.session_state.last_refresh_time, 
-                expires_at=st.session_state.next_refresh_time,
-                refresh_interval=refresh_interval
-            )
-            seq = checkpoint["current_qr_sequence"]
-            
-            qr_img = QRManager.generate_qr_image(qr_raw_content, box_size=15)
-            img_bytes = io.BytesIO()
-            qr_img.save(img_bytes, format='PNG')
-            img_bytes = img_bytes.getvalue()
+            settings_key = dynamic_settings_key(settings)
+            current = st.session_state.get("dynamic_qr")
+            if current is None or current["checkpoint_id"] != checkpoint["id"] or current["settings_key"] != settings_key:
+                if settings_key[0] == "time_bucket":
+                    # Time-bucket mode: sequence derived from the clock, nothing stored per rotation
+                    seq, issued_at, _ = QRManager.get_time_bucket(current_time_utc, settings_key[1])
+                else:
+                    seq, issued_at = checkpoint["current_qr_sequence"] + 1, current_time_utc
+                activate_dynamic_qr(build_dynamic_qr(checkpoint["id"], seq, issued_at, settings_key))
             
             # Display
             col1, col2, col3 = st.columns([1, 2, 1])
             with col2:
                 st.markdown('<div class="qr-container">', unsafe_allow_html=True)
-                st.image(img_bytes, width=400)
                 
-                # Countdown & Progress
-                countdown_str = TimeValidator.format_countdown(time_until_refresh)
-                st.markdown(f'<div class="countdown">⏱️ Auto-refresh in: {countdown_str}</div>', unsafe_allow_html=True)
-                st.markdown(f'<div class="sequence-no">Sequence: #{seq}</div>', unsafe_allow_html=True)
+                # QR (sent once per code), then countdown & progress (tick every second on their own)
+                dynamic_qr_image()
                 st.markdown('</div>', unsafe_allow_html=True)
-                
-                # Progress bar (Full -> Empty)
-                progress = max(0.0, min(1.0, time_until_refresh / refresh_interval))
-                st.progress(progress)
+                dynamic_qr_countdown()
                 
                 st.info("ℹ️ Dynamic Mode: Auto-refreshes for security.")
-
-            # Auto-refresh loop (1s)
-            time_module.sleep(1)
-            st.rerun()
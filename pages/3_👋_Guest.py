@@ -1,42 +1,21 @@
 import streamlit as st
 import time as time_module
 from datetime import datetime, timedelta, date
-from PIL import Image
-import io
-import pytz
 
-# Fix for macOS Homebrew zbar location
-import os
-import ctypes.util
-original_find_library = ctypes.util.find_library
-
-def patched_find_library(name):
-    if name == 'zbar':
-        # Check standard Homebrew path
-        if os.path.exists('/opt/homebrew/lib/libzbar.dylib'):
-            return '/opt/homebrew/lib/libzbar.dylib'
-    return original_find_library(name)
-
-ctypes.util.find_library = patched_find_library
-
-# Try to import pyzbar
-try:
-    from pyzbar.pyzbar import decode
-    PYZBAR_AVAILABLE = True
-except ImportError:
-    PYZBAR_AVAILABLE = False
-except Exception:
-    PYZBAR_AVAILABLE = False
-
-from core.storage import JSONStorage
+from core.storage import get_storage, get_log_writer
 from core.models import ActivityLog
 from core.qr_manager import QRManager
+from core.qr_decoder import (
+    get_decode_service, image_digest, DecodeBusyError, DecodeTimeoutError, PYZBAR_AVAILABLE
+)
 from core.time_service import TimeService
-from core.time_validator import TimeValidator
-from utils.helpers import get_checkpoint_name
+from core.time_validator import TimeValidator, compile_schedule
+from utils.helpers import get_checkpoint_name, get_checkpoint_names
 
 # Initialize storage
-storage = JSONStorage()
+storage = get_storage()
+log_writer = get_log_writer()
+decode_service = get_decode_service()
 
 # Page Config
 st.set_page_config(page_title="Guest - QR In/Out", page_icon="👋", layout="wide")
@@ -81,33 +60,18 @@ def verify_guest(name: str, email: str):
     Verify guest credentials case-insensitively.
     Returns None if guest not found or has been deleted.
     """
-    name_clean = name.strip().lower()
-    email_clean = email.strip().lower()
-
-    guests = storage.get_active_guests()  # Already filters out deleted guests
-    for g in guests:
-        if g["name"].strip().lower() == name_clean and g["email"].strip().lower() == email_clean:
-            # Double-check that guest is not deleted (defensive programming)
-            if g.get("deleted_at") is not None:
-                return None  # Guest has been deleted
+    # Index lookup over active guests only (normalizes case and whitespace)
+    for guest_id in storage.find_guest_ids_by_name_email(name, email):
+        g = storage.get_by_id("guests", guest_id)
+        # Double-check that guest is not deleted (defensive programming)
+        if g and g.get("deleted_at") is None:
             return g
     return None
 
 def get_last_activity(guest_id: str, checkpoint_id: str):
     """Get the last successful activity for a guest at a checkpoint."""
-    logs = storage.load("activity_logs")
-    # Filter for this guest and checkpoint, success only
-    relevant = [
-        l for l in logs 
-        if l["guest_id"] == guest_id 
-        and l["checkpoint_id"] == checkpoint_id 
-        and l["status"] == "success"
-    ]
-    if not relevant:
-        return None
-    # Sort by timestamp descending
-    relevant.sort(key=lambda x: x["timestamp"], reverse=True)
-    return relevant[0]
+    # Constant-time lookup in the presence table maintained on every log write
+    return storage.get_presence(guest_id, checkpoint_id)
 
 def validate_qr_scan(qr_data, guest, action, current_time, is_synced):
     """
@@ -133,19 +97,29 @@ def validate_qr_scan(qr_data, guest, action, current_time, is_synced):
             return False, invalid_reason
             
         # Additional Sequence Check
-        qr_seq = qr_data.get("sequence", 0)
-        curr_seq = checkpoint.get("current_qr_sequence", 0)
-        if qr_seq < curr_seq:
-            return False, "Expired QR Code (Old sequence). Please scan a fresh code."
+        settings = storage.load_admin_settings()
+        if settings.get("dynamic_qr_mode", "counter") == "time_bucket":
+            # Sequence must be the current clock bucket; no stored counter involved
+            is_current, invalid_reason = QRManager.validate_time_bucket_sequence(
+                qr_data, current_time, settings["qr_refresh_interval"]
+            )
+            if not is_current:
+                return False, invalid_reason
+        else:
+            qr_seq = qr_data.get("sequence", 0)
+            curr_seq = checkpoint.get("current_qr_sequence", 0)
+            if qr_seq < curr_seq:
+                return False, "Expired QR Code (Old sequence). Please scan a fresh code."
 
     # 3. Guest Authorization (Checkpoint allowed lists)
     if guest["id"] not in checkpoint["allowed_guests"]:
         return False, "You are not authorized for this checkpoint."
         
     # 4. Checkpoint Operating Hours
-    allowed, msg = TimeValidator.is_within_allowed_hours(current_time, checkpoint["allowed_hours"])
+    schedule = compile_schedule(checkpoint["allowed_hours"])
+    allowed, msg = TimeValidator.is_within_allowed_hours(current_time, schedule)
     if not allowed:
-        return False, f"Checkpoint closed: {msg} ({checkpoint['allowed_hours']['start_time']}-{checkpoint['allowed_hours']['end_time']})"
+        return False, f"Checkpoint closed: {msg} (today: {schedule.hours_text(current_time.date())})"
         
     # 5. Guest Specific Hours
     if guest.get("allowed_hours"):
@@ -165,6 +139,51 @@ def validate_qr_scan(qr_data, guest, action, current_time, is_synced):
 
 # --- Main Logic ---
 
+# Scans already handled in this session, kept so reruns replay the result
+MAX_PROCESSED_SCANS = 20
+
+def process_scan(image_bytes, digest, guest, action_code, action_label, current_time, is_synced):
+    """
+    Decode, validate and log one scanned image.
+    Returns: (level: "success" | "error" | "warning", message: str)
+    """
+    # Decode on the shared pool (grayscale, progressive downsample, contrast/threshold variants)
+    decode_result = decode_service.decode(image_bytes, digest=digest)
+    if decode_result.data is None:
+        return "warning", "Could not detect QR code in the image."
+
+    qr_str = decode_result.data
+    qr_data_obj = QRManager.parse_qr_content(qr_str)
+    if not qr_data_obj or qr_data_obj.get("type") != "qr_in_out":
+        return "error", "Invalid QR Code format."
+
+    # Validate
+    is_valid, validation_msg = validate_qr_scan(
+        qr_data_obj, guest, action_code, current_time, is_synced
+    )
+
+    # Log result
+    status = "success" if is_valid else "failure"
+
+    log = ActivityLog.create_new(
+        checkpoint_id=qr_data_obj.get("checkpoint_id", "unknown"),
+        guest_id=guest["id"],
+        action=action_code,
+        qr_code_used=qr_str,
+        status=status,
+        failure_reason=validation_msg if not is_valid else None,
+        metadata={"scanned_at": current_time.isoformat(), "image_sha256": digest}
+    )
+    # A successful scan updates presence, which the guest's next scan is
+    # validated against, so it is committed before responding even when
+    # QR_LOG_DURABILITY=async (only failed scans are written behind)
+    log_writer.submit(log.to_dict(), sync=True if is_valid else None)
+
+    if is_valid:
+        cp_name = get_checkpoint_name(qr_data_obj.get("checkpoint_id"))
+        return "success", f"✅ Correctly {action_label} at **{cp_name}**!"
+    return "error", f"❌ {action_label} Failed: {validation_msg}"
+
 if "guest_authenticated" not in st.session_state:
     st.session_state.guest_authenticated = False
     st.session_state.current_guest = None
@@ -229,60 +248,60 @@ else:
         if not PYZBAR_AVAILABLE:
             st.warning("⚠️ `pyzbar` library is not available. Camera scanning might not work properly.")
         
+        # Capture widgets are keyed by a version bumped after every processed
+        # scan: the new keys start empty, so a photo is never submitted twice
+        widget_version = st.session_state.setdefault("scan_widget_version", 0)
+
         # Camera Input
-        img_buffer = st.camera_input("Scan QR Code")
+        img_buffer = st.camera_input("Scan QR Code", key=f"scan_camera_{widget_version}")
         
         # Fallback File Uploader
         with st.expander("Or upload QR image"):
-            uploaded_file = st.file_uploader("Upload Image", type=['png', 'jpg', 'jpeg'])
+            uploaded_file = st.file_uploader("Upload Image", type=['png', 'jpg', 'jpeg'],
+                                             key=f"scan_upload_{widget_version}")
+
+        # Outcome of the scan processed on the previous run (its capture is now cleared)
+        last_result = st.session_state.pop("last_scan_result", None)
+        if last_result is not None:
+            level, message, is_new_scan = last_result
+            if level == "success":
+                if is_new_scan:
+                    st.balloons()
+                st.success(message)
+            elif level == "error":
+                st.error(message)
+            else:
+                st.warning(message)
             
         to_process = img_buffer or uploaded_file
         
         if to_process:
+            image_bytes = to_process.getvalue()
+            digest = image_digest(image_bytes)
+            # Idempotency key: the same photo (e.g. re-uploaded, or with the
+            # Action radio switched) replays its result instead of logging again
+            scan_key = (guest["id"], digest)
+            processed = st.session_state.setdefault("processed_scans", {})
+            is_new_scan = scan_key not in processed
             try:
-                # Open Image
-                image = Image.open(to_process)
-                
-                # Decode
-                decoded = decode(image)
-                
-                if decoded:
-                    qr_str = decoded[0].data.decode("utf-8")
-                    qr_data_obj = QRManager.parse_qr_content(qr_str)
-                    
-                    if qr_data_obj and qr_data_obj.get("type") == "qr_in_out":
-                        # Validate
-                        is_valid, validation_msg = validate_qr_scan(
-                            qr_data_obj, guest, action_code, current_time_val, is_synced_val
-                        )
-                        
-                        # Log result
-                        status = "success" if is_valid else "failure"
-                        
-                        log = ActivityLog.create_new(
-                            checkpoint_id=qr_data_obj.get("checkpoint_id", "unknown"),
-                            guest_id=guest["id"],
-                            action=action_code,
-                            qr_code_used=qr_str,
-                            status=status,
-                            failure_reason=validation_msg if not is_valid else None,
-                            metadata={"scanned_at": current_time_val.isoformat()}
-                        )
-                        storage.add("activity_logs", log.to_dict())
-                        
-                        if is_valid:
-                            cp_name = get_checkpoint_name(qr_data_obj.get("checkpoint_id"))
-                            st.balloons()
-                            st.success(f"✅ Correctly {action_select} at **{cp_name}**!")
-                        else:
-                            st.error(f"❌ {action_select} Failed: {validation_msg}")
-                            
-                    else:
-                        st.error("Invalid QR Code format.")
-                else:
-                    st.warning("Could not detect QR code in the image.")
+                if is_new_scan:
+                    processed[scan_key] = process_scan(
+                        image_bytes, digest, guest, action_code, action_select,
+                        current_time_val, is_synced_val
+                    )
+                    while len(processed) > MAX_PROCESSED_SCANS:
+                        processed.pop(next(iter(processed)))
+                st.session_state.last_scan_result = (*processed[scan_key], is_new_scan)
+                st.session_state.scan_widget_version = widget_version + 1
+            except DecodeBusyError:
+                st.warning("⏳ Scanner is busy. Please try again in a moment.")
+            except DecodeTimeoutError:
+                st.warning("⏳ Scanning took too long. Please retake the photo closer to the QR code.")
             except Exception as e:
                 st.error(f"Error processing image: {e}")
+            if "last_scan_result" in st.session_state:
+                # Redraw with fresh (empty) capture widgets and show the result
+                st.rerun()
 
     with tab_history:
         st.write("### Your Recent Activity")
@@ -294,25 +313,17 @@ else:
         with hc2:
             h_end = st.date_input("End Date", value=date.today())
             
-        logs = storage.load("activity_logs")
-        my_logs = [l for l in logs if l["guest_id"] == guest["id"]]
-        
-        # Filter dates
-        filtered_logs = []
-        for l in my_logs:
-            try:
-                ts = datetime.fromisoformat(l["timestamp"])
-                if h_start <= ts.date() <= h_end:
-                    filtered_logs.append(l)
-            except ValueError:
-                continue
+        filtered_logs = storage.load_activity_logs(
+            start_date=h_start, end_date=h_end, guest_id=guest["id"]
+        )
                  
         filtered_logs.sort(key=lambda x: x["timestamp"], reverse=True)
         
         if filtered_logs:
+            cp_names = get_checkpoint_names()
             for l in filtered_logs[:20]: # Show last 20
                 ts = datetime.fromisoformat(l["timestamp"])
-                cp_name = get_checkpoint_name(l["checkpoint_id"])
+                cp_name = cp_names.get(l["checkpoint_id"], "Unknown Checkpoint")
                  
                 with st.container():
                     lc1, lc2 = st.columns([3, 1])
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+QR Payload Benchmark for QR In/Out System
+
+Compares the JSON ("1.0") and compact ("2.0") payload formats: payload length,
+QR version / module count, render time and, when pyzbar is installed, decode
+time. Payloads are signed with QR_SECRET_KEY (a throwaway key is used if it is
+not set).
+
+Usage:
+    python scripts/benchmark_qr_payload.py [--iterations 50] [--box-size 4]
+"""
+
+import os
+import sys
+import time
+import uuid
+import secrets
+import argparse
+from datetime import datetime
+
+import pytz
+import qrcode
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+os.environ.setdefault("QR_SECRET_KEY", secrets.token_hex(32))
+
+from core.qr_manager import QRManager
+
+try:
+    from pyzbar.pyzbar import decode as zbar_decode
+except ImportError:
+    zbar_decode = None
+
+
+def build_payloads(refresh_interval: int):
+    checkpoint_id = str(uuid.uuid4())
+    now = datetime.now(pytz.UTC)
+    payloads = {}
+    for payload_format in ("json", "compact"):
+        payloads[f"static/{payload_format}"] = QRManager.generate_static_qr_content(
+            checkpoint_id, payload_format=payload_format
+        )
+        payloads[f"dynamic/{payload_format}"] = QRManager.generate_time_bucket_qr_content(
+            checkpoint_id, now, refresh_interval, payload_format=payload_format
+        )
+    return payloads
+
+
+def timed(func, iterations: int) -> float:
+    """Average wall time of func() in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) * 1000 / iterations
+
+
+def benchmark(content: str, iterations: int, box_size: int) -> dict:
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=box_size, border=4)
+    qr.add_data(content)
+    qr.make(fit=True)
+
+    result = {
+        "chars": len(content),
+        "version": qr.version,
+        "modules": qr.modules_count,
+        "render_ms": timed(lambda: QRManager.generate_qr_image(content, box_size=box_size), iterations),
+        "decode_ms": None,
+    }
+    if zbar_decode is not None:
+        image = QRManager.generate_qr_image(content, box_size=box_size).convert("L")
+        decoded = zbar_decode(image)
+        assert decoded and QRManager.parse_qr_content(decoded[0].data.decode("utf-8")) is not None
+        result["decode_ms"] = timed(lambda: zbar_decode(image), iterations)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare QR payload formats.")
+    parser.add_argument("--iterations", type=int, default=50, help="Timing iterations per payload")
+    parser.add_argument("--box-size", type=int, default=4,
+                        help="Pixels per module (small values approximate a camera frame)")
+    parser.add_argument("--refresh-interval", type=int, default=1800, help="Dynamic QR refresh interval (seconds)")
+    args = parser.parse_args()
+
+    if zbar_decode is None:
+        print("[WARN] pyzbar not installed: decode times skipped")
+
+    print(f"{'payload':<18}{'chars':>7}{'version':>9}{'modules':>9}{'render ms':>11}{'decode ms':>11}")
+    for name, content in build_payloads(args.refresh_interval).items():
+        r = benchmark(content, args.iterations, args.box_size)
+        decode_ms = f"{r['decode_ms']:.2f}" if r["decode_ms"] is not None else "-"
+        print(f"{name:<18}{r['chars']:>7}{r['version']:>9}{r['modules']:>9}{r['render_ms']:>11.2f}{decode_ms:>11}")
+
+
+if __name__ == "__main__":
+    main()
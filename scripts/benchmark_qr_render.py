@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+QR Render Benchmark for QR In/Out System
+
+Compares the Host display rendering paths: PIL raster encoded as PNG, SVG,
+and the raw module matrix. For each payload format it reports
+  image:    bytes of the image itself
+  per emit: bytes in the message every time st.image() is (re-)emitted.
+            Streamlit inlines an SVG string as a base64 data: URI, while PNG
+            bytes go through its media file manager and only a short
+            /media/<sha224>.<ext> URL is sent (the browser fetches it once).
+  cpu ms:   CPU time per (uncached) render
+
+Usage:
+    python scripts/benchmark_qr_render.py [--iterations 50] [--box-size 15]
+"""
+
+import os
+import sys
+import time
+import uuid
+import secrets
+import base64
+import argparse
+from datetime import datetime
+
+import pytz
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+os.environ.setdefault("QR_SECRET_KEY", secrets.token_hex(32))
+
+from core.qr_manager import QRManager
+
+
+# What st.image() puts in the message for bytes served by the media file manager
+MEDIA_URL_BYTES = len(f"/media/{'0' * 56}.png")
+
+
+def svg_data_uri(svg: str) -> str:
+    """How Streamlit ships an SVG string to the browser (see st.image)."""
+    return "data:image/svg+xml;base64," + base64.b64encode(svg.encode("utf-8")).decode("ascii")
+
+
+def cpu_ms(func, iterations: int) -> float:
+    """Average process CPU time of func() in milliseconds."""
+    start = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - start) * 1000 / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare QR rendering paths for the Host display.")
+    parser.add_argument("--iterations", type=int, default=50, help="Renders per measurement")
+    parser.add_argument("--box-size", type=int, default=15, help="Pixels per module for the PNG path")
+    args = parser.parse_args()
+
+    # Bypass the LRU caches: measure the cost of a render, not of a lookup
+    render_png = QRManager.generate_qr_bytes.__wrapped__
+    render_svg = QRManager.generate_qr_svg.__wrapped__
+    render_matrix = QRManager.generate_qr_matrix.__wrapped__
+
+    checkpoint_id = str(uuid.uuid4())
+    now = datetime.now(pytz.UTC)
+
+    print(f"{'payload':<10}{'mode':<8}{'image':>9}{'per emit':>10}{'cpu ms':>9}")
+    for payload_format in ("json", "compact"):
+        content = QRManager.generate_time_bucket_qr_content(checkpoint_id, now, payload_format=payload_format)
+        matrix = render_matrix(content)
+        svg = render_svg(content)
+        # Bit-packed, as it would be sent to a client-side renderer on every emit
+        matrix_bytes = (len(matrix) ** 2 + 7) // 8
+        results = {
+            "png": (len(render_png(content, args.box_size)), MEDIA_URL_BYTES,
+                    cpu_ms(lambda: render_png(content, args.box_size), args.iterations)),
+            # generate_qr_svg reuses the cached matrix, so time it cold too
+            "svg": (len(svg.encode("utf-8")), len(svg_data_uri(svg)),
+                    cpu_ms(lambda: (QRManager.generate_qr_matrix.cache_clear(), render_svg(content)),
+                           args.iterations)),
+            "matrix": (matrix_bytes, matrix_bytes,
+                       cpu_ms(lambda: render_matrix(content), args.iterations)),
+        }
+        for mode, (size, per_emit, ms) in results.items():
+            print(f"{payload_format:<10}{mode:<8}{size:>9}{per_emit:>10}{ms:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Printable QR Sheet Export for QR In/Out System
+
+Renders the static QR codes of the selected checkpoints in parallel (one
+process per CPU core) and writes them, labelled with checkpoint name and
+location, to a multi-page A4 PDF or a ZIP of PNGs. Uses the storage backend
+configured in the environment (QR_STORAGE_BACKEND).
+
+Usage:
+    python scripts/export_qr_sheets.py [--format pdf|zip] [--output qr_sheets.pdf]
+                                       [--checkpoint NAME_OR_ID ...] [--grid 2x3]
+                                       [--workers N] [--font path/to/font.ttf]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from core.storage import get_storage
+from core.qr_export import export_qr_sheets, EXPORT_FORMATS
+
+
+def select_checkpoints(storage, selectors):
+    """Active static checkpoints, optionally restricted to the given names/ids."""
+    checkpoints = [c for c in storage.get_active_checkpoints() if c["qr_mode"] == "static"]
+    if not selectors:
+        return checkpoints
+    selected = [c for c in checkpoints if c["id"] in selectors or c["name"] in selectors]
+    missing = set(selectors) - {c["id"] for c in selected} - {c["name"] for c in selected}
+    for selector in sorted(missing):
+        print(f"[WARN] No active static checkpoint matches: {selector}")
+    return selected
+
+
+def parse_grid(value: str):
+    try:
+        columns, rows = (int(part) for part in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("grid must look like 2x3")
+    if columns < 1 or rows < 1:
+        raise argparse.ArgumentTypeError("grid must be at least 1x1")
+    return columns, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export printable static QR codes for checkpoints.")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="pdf", help="Output format")
+    parser.add_argument("--output", help="Output file (default: qr_sheets.<format>)")
+    parser.add_argument("--checkpoint", action="append", default=[],
+                        help="Checkpoint name or id to include (repeatable; default: all static checkpoints)")
+    parser.add_argument("--grid", type=parse_grid, default=(2, 3), help="Labels per PDF page, COLUMNSxROWS")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: CPU count)")
+    parser.add_argument("--font", help="TrueType font for labels (needed for non-Latin names)")
+    args = parser.parse_args()
+
+    storage = get_storage()
+    checkpoints = select_checkpoints(storage, args.checkpoint)
+    if not checkpoints:
+        print("[ERROR] No static checkpoints to export")
+        sys.exit(1)
+
+    output = args.output or f"qr_sheets.{args.format}"
+    payload_format = storage.load_admin_settings().get("qr_payload_format", "json")
+
+    start = time.perf_counter()
+    count = export_qr_sheets(
+        checkpoints, output, export_format=args.format, payload_format=payload_format,
+        grid=args.grid, max_workers=args.workers, font_path=args.font,
+        # Safe here: this script has a real __main__ guard for spawned workers
+        use_processes=True,
+        progress=lambda done, total: print(f"\r[EXPORT] {done}/{total}", end="", flush=True)
+    )
+    print(f"\n[DONE] {count} QR code(s) written to {output} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+JSON -> SQLite Migration Script for QR In/Out System
+
+Imports the existing data/*.json(l) files into a SQLite database usable with
+QR_STORAGE_BACKEND=sqlite. Existing tables in the target database are
+replaced entity by entity; the JSON files are left untouched.
+
+Usage:
+    python scripts/migrate_json_to_sqlite.py [--data-dir data] [--db data/qr_in_out.db]
+"""
+
+import os
+import sys
+import argparse
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from core.storage import JSONStorage
+from core.sqlite_storage import SQLiteStorage
+
+
+def migrate(data_dir: str, db_path: str):
+    source = JSONStorage(data_dir)
+    target = SQLiteStorage(db_path)
+    for entity_type in JSONStorage.ENTITY_TYPES:
+        # Not load(): that would migrate legacy log files inside data_dir
+        data = source.read_snapshot(entity_type)
+        target.save(entity_type, data)
+        print(f"[MIGRATE] {entity_type}: {len(data)} record(s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import JSON data files into a SQLite database.")
+    parser.add_argument("--data-dir", default=os.path.join(PROJECT_ROOT, "data"),
+                        help="Directory containing the JSON data files")
+    parser.add_argument("--db", default=os.path.join(PROJECT_ROOT, "data", "qr_in_out.db"),
+                        help="Target SQLite database path")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data_dir):
+        print(f"[ERROR] Data directory not found: {args.data_dir}")
+        sys.exit(1)
+
+    migrate(args.data_dir, args.db)
+    print(f"[DONE] Set QR_STORAGE_BACKEND=sqlite and QR_SQLITE_PATH={args.db} to use it.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
-from core.storage import JSONStorage
+from core.storage import get_storage
+from typing import Dict
 import re
 
-storage = JSONStorage()
+storage = get_storage()
 
 def get_checkpoint_name(checkpoint_id: str) -> str:
     checkpoint = storage.get_by_id("checkpoints", checkpoint_id)
@@ -21,20 +22,42 @@ def is_valid_email(email: str) -> bool:
     return re.match(pattern, email) is not None
 
 def checkpoint_name_exists(name: str, exclude_id: str = None) -> bool:
-    checkpoints = storage.load("checkpoints")
-    for cp in checkpoints:
-        if cp["name"] == name and cp["id"] != exclude_id and cp.get('deleted_at') is None:
-            return True
-    return False
+    return any(cp_id != exclude_id for cp_id in storage.find_checkpoint_ids_by_name(name))
 
 def guest_email_exists(email: str, exclude_id: str = None) -> bool:
-    guests = storage.load("guests")
-    for g in guests:
-        if g["email"] == email and g["id"] != exclude_id and g.get('deleted_at') is None:
-            return True
-    return False
+    """Case-insensitive, matching how guests log in."""
+    return any(g_id != exclude_id for g_id in storage.find_guest_ids_by_email(email))
 
 def get_checkpoint_location(checkpoint_id: str) -> str:
     """Get checkpoint location by ID."""
     checkpoint = storage.get_by_id("checkpoints", checkpoint_id)
     return checkpoint["location"] if checkpoint else "Unknown Location"
+
+# --- Bulk lookups ---
+# Build each map once per page run instead of calling get_*_name per row/option.
+# They include removed entities so historical logs still resolve.
+
+def get_checkpoint_names() -> Dict[str, str]:
+    return {c["id"]: c["name"] for c in storage.load("checkpoints")}
+
+def get_checkpoint_labels() -> Dict[str, str]:
+    """Checkpoint id -> "name (location)"."""
+    return {c["id"]: f"{c['name']} ({c.get('location', '')})" for c in storage.load("checkpoints")}
+
+def get_guest_names() -> Dict[str, str]:
+    return {g["id"]: g["name"] for g in storage.load("guests")}
+
+def get_guest_labels() -> Dict[str, str]:
+    """Guest id -> "name (email)"."""
+    return {g["id"]: f"{g['name']} ({g['email']})" for g in storage.load("guests")}
+
+def add_name_columns(df):
+    """
+    Add checkpoint_name / guest_name columns to an activity log DataFrame
+    with a vectorized map over the id columns.
+    """
+    if "checkpoint_id" in df.columns:
+        df["checkpoint_name"] = df["checkpoint_id"].map(get_checkpoint_names()).fillna("Unknown Checkpoint")
+    if "guest_id" in df.columns:
+        df["guest_name"] = df["guest_id"].map(get_guest_names()).fillna("Unknown Guest")
+    return df